@@ -8,6 +8,8 @@ import chess.svg
 
 class InteractiveBoard(QWidget):
     move_played = pyqtSignal(chess.Move)
+    # Emitted after every redraw so listeners can react to position changes
+    board_updated = pyqtSignal()
 
     def __init__(self, board=None):
         super().__init__()
@@ -67,6 +69,7 @@ class InteractiveBoard(QWidget):
 
         self.renderer.load(svg_data)
         self.update()
+        self.board_updated.emit()
 
     def get_square_from_mouse(self, x, y):
         side = float(min(self.width(), self.height()))
@@ -0,0 +1,401 @@
+"""
+Headless command-line interface for ChessForge.
+
+Works on the same database as the desktop app but never imports PyQt6,
+so it can be used for scripting bulk jobs on a server:
+
+    python cli.py import repertoire.pgn --name "Najdorf" --color Black
+    python cli.py export "Najdorf" -o najdorf.pgn
+    python cli.py analyse "Najdorf" --time 0.2
+    python cli.py coverage "Najdorf" my_games.pgn --player me
+    python cli.py stats
+    python cli.py vacuum
+"""
+import argparse
+import os
+import sys
+
+import chess
+
+from database import ChessDatabase
+
+
+def open_database(args):
+    if args.db:
+        folder, filename = os.path.split(os.path.abspath(args.db))
+        return ChessDatabase(filename, data_folder=folder, verbose=False)
+    return ChessDatabase(verbose=False)
+
+
+def resolve_repertoire(db, value):
+    """Accepts a repertoire id or name, returns the matching row."""
+    for row in db.get_repertoires():
+        if str(row['id']) == value or row['name'] == value:
+            return row
+    raise SystemExit(f"Repertoire not found: {value}")
+
+
+def start_engine(args):
+    # Imported here so commands that do not need Stockfish stay fast
+    from engine_handler import EngineHandler, default_engine_path
+
+    engine = EngineHandler(args.engine or default_engine_path(), threads=getattr(args, "threads", None),
+                           hash_mb=getattr(args, "hash", None), multipv=getattr(args, "multipv", None))
+    try:
+        engine.start_engine()
+    except FileNotFoundError as e:
+        raise SystemExit(str(e))
+    return engine
+
+
+# --- IMPORT ---
+def _import_node(db, repertoire_id, node, board):
+    for child in node.variations:
+        from_fen = board.fen()
+        board.push(child.move)
+        db.add_move(repertoire_id, from_fen, board.fen(), child.move.uci(), child.comment.strip())
+        _import_node(db, repertoire_id, child, board)
+        board.pop()
+
+
+def cmd_import(args):
+    import chess.pgn
+
+    db = open_database(args)
+    existing = [r for r in db.get_repertoires() if r['name'] == args.name]
+    repertoire_id = existing[0]['id'] if existing else db.add_repertoire(args.name, args.color)
+
+    games = 0
+    with open(args.pgn, encoding="utf-8", errors="replace") as handle, db.bulk():
+        while True:
+            game = chess.pgn.read_game(handle)
+            if game is None:
+                break
+            _import_node(db, repertoire_id, game, game.board())
+            games += 1
+
+    print(f"Imported {games} game(s) into '{args.name}' (id {repertoire_id})")
+    db.close()
+
+
+# --- EXPORT ---
+def _export_node(db, repertoire_id, node, board, visited):
+    fen_simple = " ".join(board.fen().split(" ")[:4])
+    if fen_simple in visited:
+        return
+    visited.add(fen_simple)
+
+    for row in db.get_moves_from_fen(repertoire_id, board.fen()):
+        try:
+            move = chess.Move.from_uci(row['uci'])
+        except ValueError:
+            continue
+        if move not in board.legal_moves:
+            continue
+        child = node.add_variation(move, comment=row['comment'] or "")
+        board.push(move)
+        _export_node(db, repertoire_id, child, board, visited)
+        board.pop()
+
+    visited.remove(fen_simple)
+
+
+def cmd_export(args):
+    import chess.pgn
+
+    db = open_database(args)
+    rep = resolve_repertoire(db, args.repertoire)
+    game = chess.pgn.Game()
+    game.headers["Event"] = rep['name']
+    game.headers["White"] = "Repertoire" if rep['color'] == "White" else "?"
+    game.headers["Black"] = "Repertoire" if rep['color'] == "Black" else "?"
+    _export_node(db, rep['id'], game, game.board(), set())
+    db.close()
+
+    text = str(game) + "\n"
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+# --- ANALYSE ---
+def cmd_analyse(args):
+    if args.fen:
+        fens = [args.fen]
+    else:
+        db = open_database(args)
+        rep = resolve_repertoire(db, args.repertoire)
+        fens = db.get_leaf_fens(rep['id'])
+        db.close()
+
+    engine = start_engine(args)
+    try:
+        for fen in fens:
+            info = engine.get_evaluation(fen, time_limit=args.time, adaptive=args.adaptive)
+            if not info:
+                continue
+            search = engine.last_search
+            # One line per principal variation with --multipv
+            for line in (info if isinstance(info, list) else [info]):
+                score = line["score"].white() if "score" in line else "-"
+                best_move = line["pv"][0].uci() if line.get("pv") else "-"
+                print(f"{fen}\t{score}\t{best_move}\tdepth={search['depth']}\ttime={search['time']:.2f}s")
+    finally:
+        engine.stop_engine()
+
+
+# --- COVERAGE ---
+def cmd_coverage(args):
+    from repertoire_coverage import analyse_coverage
+    from repertoire_tree import RepertoireTree
+
+    db = open_database(args)
+    rep = resolve_repertoire(db, args.repertoire)
+    tree = RepertoireTree.from_database(db, rep['id'])
+    db.close()
+
+    report = analyse_coverage(args.pgn, tree, rep['color'], player=args.player, workers=args.workers)
+    counted = report.games - report.outcomes["skipped"]
+    print(f"{report.games} game(s) read, {counted} played with the repertoire color")
+    print(f"  left the repertoire: {report.outcomes['deviation']}, "
+          f"reached end of line: {report.outcomes['end_of_line']}, "
+          f"stayed in book: {report.outcomes['in_book']}")
+    for count, fen, ply, san, who in report.ranked(args.top):
+        node = tree.node_for_board(chess.Board(fen))
+        expected = ", ".join(tree.san(edge) for edge in tree.edges(node))
+        number = f"{ply // 2 + 1}{'.' if ply % 2 == 0 else '...'}"
+        print(f"{count:>6}  {number}{san} ({who}; repertoire: {expected})  {fen}")
+
+
+# --- SEARCH ---
+def cmd_search(args):
+    db = open_database(args)
+    rep_id = resolve_repertoire(db, args.repertoire)['id'] if args.repertoire else None
+    for row in db.search_comments(" ".join(args.words), repertoire_id=rep_id, limit=args.limit):
+        print(f"{row['name']}\t{row['uci']}\t{row['snippet']}\t{row['from_fen']}")
+    db.close()
+
+
+# --- SNAPSHOTS ---
+def cmd_snapshot(args):
+    from snapshot import export_snapshot
+
+    db = open_database(args)
+    rep = resolve_repertoire(db, args.repertoire)
+    tree = export_snapshot(db, rep['id'], args.output)
+    db.close()
+    print(f"Wrote {len(tree)} moves of '{rep['name']}' to {args.output}")
+
+
+def cmd_restore(args):
+    from snapshot import import_snapshot
+
+    db = open_database(args)
+    repertoire_id = import_snapshot(db, args.snapshot, name=args.name)
+    print(f"Restored {args.snapshot} as repertoire {repertoire_id}")
+    db.close()
+
+
+# --- DIFF / MERGE ---
+def cmd_diff(args):
+    db = open_database(args)
+    rep_a = resolve_repertoire(db, args.a)
+    rep_b = resolve_repertoire(db, args.b)
+    diff = db.diff_repertoires(rep_a['id'], rep_b['id'])
+    for label, rows in ((f"Only in '{rep_a['name']}'", diff['only_in_a']), (f"Only in '{rep_b['name']}'", diff['only_in_b'])):
+        print(f"{label}: {len(rows)} move(s)")
+        for row in rows:
+            print(f"  {row['uci']}\t{row['from_fen']}")
+    print(f"Conflicting comments: {len(diff['conflicts'])}")
+    for row in diff['conflicts']:
+        print(f"  {row['uci']}\t{row['comment_a']!r} / {row['comment_b']!r}\t{row['from_fen']}")
+    db.close()
+
+
+def cmd_merge(args):
+    db = open_database(args)
+    source = resolve_repertoire(db, args.source)
+    target = resolve_repertoire(db, args.target)
+    added, updated = db.merge_repertoires(source['id'], target['id'], overwrite_comments=args.overwrite_comments)
+    print(f"Merged '{source['name']}' into '{target['name']}': {added} move(s) added, {updated} comment(s) updated")
+    db.close()
+
+
+# --- EXPAND ---
+def cmd_expand(args):
+    from engine_handler import default_engine_path
+    from expansion import RepertoireExpander, ExpansionSettings
+
+    db = open_database(args)
+    rep = resolve_repertoire(db, args.repertoire)
+    db_path = db.db_path
+    db.close()
+
+    settings = ExpansionSettings(top_n=args.top, min_score=args.min_score, depth=args.depth, workers=args.workers,
+                                 restart=args.restart)
+    expander = RepertoireExpander(db_path, args.engine or default_engine_path(), rep['id'], settings)
+    try:
+        expander.run()
+    except KeyboardInterrupt:
+        expander.stop()
+    if expander.error:
+        print(f"Error: {expander.error}", file=sys.stderr)
+    print(f"Expanded {expander.done}/{expander.total} position(s) of '{rep['name']}', {expander.added} move(s) added")
+
+
+# --- STATS ---
+def cmd_stats(args):
+    db = open_database(args)
+    for rep in db.get_repertoires():
+        stats = db.get_repertoire_stats(rep['id'])
+        print(f"{rep['id']:>4}  {rep['name']} ({rep['color']}): "
+              f"{stats['moves']} moves, {stats['positions']} positions, "
+              f"{stats['leaves']} leaves, {stats['comments']} comments")
+    print(f"Database: {db.db_path} ({os.path.getsize(db.db_path) / 1024:.1f} KiB)")
+    db.close()
+
+
+# --- VACUUM ---
+def cmd_vacuum(args):
+    db = open_database(args)
+    before = os.path.getsize(db.db_path)
+    db.enable_incremental_vacuum()
+    db.vacuum()
+    db.close()
+    after = os.path.getsize(db.db_path)
+    print(f"Vacuumed {db.db_path}: {before / 1024:.1f} KiB -> {after / 1024:.1f} KiB")
+
+
+# --- VALIDATE ---
+def cmd_validate(args):
+    from validator import validate_repertoire, repair_repertoire
+
+    db = open_database(args)
+    reps = [resolve_repertoire(db, args.repertoire)] if args.repertoire else db.get_repertoires()
+    for rep in reps:
+        report = validate_repertoire(db, rep['id'], workers=args.workers)
+        print(f"{rep['name']}: {report.moves} moves, {report.summary()}")
+        if args.repair and report.issue_count:
+            repair_repertoire(db, report)
+            print(f"  repaired {report.issue_count} move(s)")
+    db.close()
+
+
+# --- MAINTAIN ---
+def cmd_maintain(args):
+    from maintenance import DatabaseMaintenance
+
+    db = open_database(args)
+    # No time slices here, so every table gets the whole-table check
+    maintenance = DatabaseMaintenance(db, full_check=True)
+    maintenance.run_all()
+    print(f"Removed {maintenance.orphans_deleted} orphaned position(s), {maintenance.free_pages} free page(s) left")
+    for problem in maintenance.problems:
+        print(f"  {problem}")
+    if not maintenance.problems:
+        print("Integrity check: ok")
+    db.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="chessforge", description="ChessForge command-line interface")
+    parser.add_argument("--db", help="Path to the database file (default: ~/Documents/ChessForge/chess_repertoire.db)")
+    parser.add_argument("--engine", help="Path to a UCI engine binary (default: bundled Stockfish)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="Import a PGN file (including variations) into a repertoire")
+    p.add_argument("pgn")
+    p.add_argument("--name", required=True, help="Repertoire name (created if missing)")
+    p.add_argument("--color", choices=["White", "Black"], default="White")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("export", help="Export a repertoire as PGN")
+    p.add_argument("repertoire", help="Repertoire id or name")
+    p.add_argument("-o", "--output", help="Output file (default: stdout)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("analyse", help="Evaluate a FEN or every leaf of a repertoire")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("repertoire", nargs="?", help="Repertoire id or name")
+    target.add_argument("--fen")
+    p.add_argument("--time", type=float, default=0.1, help="Seconds per position")
+    p.add_argument("--adaptive", action="store_true",
+                   help="Search until best move and score are stable instead of a fixed time")
+    p.add_argument("--threads", type=int, help="Engine Threads option")
+    p.add_argument("--hash", type=int, help="Engine Hash option (MB)")
+    p.add_argument("--multipv", type=int, default=1, help="Number of best lines to print per position")
+    p.set_defaults(func=cmd_analyse)
+
+    p = sub.add_parser("coverage", help="Show where your played games leave a repertoire")
+    p.add_argument("repertoire", help="Repertoire id or name")
+    p.add_argument("pgn", help="PGN file with your games")
+    p.add_argument("--player", help="Only count games where this player had the repertoire color")
+    p.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    p.add_argument("--top", type=int, default=20, help="Number of deviations to list")
+    p.set_defaults(func=cmd_coverage)
+
+    p = sub.add_parser("search", help="Full-text search over move comments")
+    p.add_argument("words", nargs="+")
+    p.add_argument("--repertoire", help="Limit to one repertoire (id or name)")
+    p.add_argument("--limit", type=int, default=50)
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("snapshot", help="Write a repertoire to a binary snapshot file")
+    p.add_argument("repertoire", help="Repertoire id or name")
+    p.add_argument("output")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("restore", help="Create a repertoire from a binary snapshot file")
+    p.add_argument("snapshot")
+    p.add_argument("--name", help="Name of the new repertoire (default: the name stored in the snapshot)")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("diff", help="Compare two repertoires")
+    p.add_argument("a", help="Repertoire id or name")
+    p.add_argument("b", help="Repertoire id or name")
+    p.set_defaults(func=cmd_diff)
+
+    p = sub.add_parser("merge", help="Copy every move of one repertoire into another")
+    p.add_argument("source", help="Repertoire id or name")
+    p.add_argument("target", help="Repertoire id or name")
+    p.add_argument("--overwrite-comments", action="store_true",
+                   help="Replace conflicting target comments with the source ones")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("expand", help="Add engine replies at every leaf where the opponent is to move")
+    p.add_argument("repertoire", help="Repertoire id or name")
+    p.add_argument("--top", type=int, default=3, help="Replies kept per position")
+    p.add_argument("--min-score", type=int, default=-100, help="Minimum score (cp) for the opponent")
+    p.add_argument("--depth", type=int, default=18, help="Engine search depth")
+    p.add_argument("--workers", type=int, default=2, help="Engine processes")
+    p.add_argument("--restart", action="store_true",
+                   help="Analyse every current leaf again, including positions expanded before")
+    p.set_defaults(func=cmd_expand)
+
+    p = sub.add_parser("stats", help="Show repertoire statistics")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("validate", help="Check repertoires for illegal, duplicate or unreachable moves")
+    p.add_argument("repertoire", nargs="?", help="Repertoire id or name (default: all)")
+    p.add_argument("--repair", action="store_true", help="Fix the problems found (one transaction per repertoire)")
+    p.add_argument("--workers", type=int, help="Worker processes for large repertoires (default: all cores)")
+    p.set_defaults(func=cmd_validate)
+
+    p = sub.add_parser("maintain", help="Remove orphaned positions, refresh statistics and check integrity")
+    p.set_defaults(func=cmd_maintain)
+
+    p = sub.add_parser("vacuum", help="Compact the database file (and enable incremental vacuum)")
+    p.set_defaults(func=cmd_vacuum)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
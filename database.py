@@ -1,26 +1,36 @@
 import sqlite3
 import os
+from contextlib import contextmanager
+
+# Positions are stored without move counters (see get_or_create_position)
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -"
 
 
 class ChessDatabase:
-    def __init__(self, db_filename="chess_repertoire.db"):
-        # --- HARDCODED DESTINATION: DOCUMENTS ---
-        user_documents = os.path.expanduser("~/Documents")
-        self.data_folder = os.path.join(user_documents, "ChessForge")
+    def __init__(self, db_filename="chess_repertoire.db", data_folder=None, verbose=True):
+        # --- DEFAULT DESTINATION: DOCUMENTS ---
+        if data_folder is None:
+            user_documents = os.path.expanduser("~/Documents")
+            data_folder = os.path.join(user_documents, "ChessForge")
+        self.data_folder = data_folder
 
         # Create folder if it doesn't exist
         if not os.path.exists(self.data_folder):
             os.makedirs(self.data_folder)
-            print(f"Created folder: {self.data_folder}")
+            if verbose:
+                print(f"Created folder: {self.data_folder}")
 
         self.db_path = os.path.join(self.data_folder, db_filename)
 
-        print("=" * 40)
-        print(f"   USING DATABASE AT: {self.db_path}")
-        print("=" * 40)
+        if verbose:
+            print("=" * 40)
+            print(f"   USING DATABASE AT: {self.db_path}")
+            print("=" * 40)
 
         self.conn = None
         self.cursor = None
+        self._bulk_depth = 0
+        self.has_fts = False
         self.connect()
         self.create_tables()
 
@@ -28,6 +38,35 @@ class ChessDatabase:
         self.conn = sqlite3.connect(self.db_path)
         self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
+        # Only takes effect on a new file; older databases are converted by enable_incremental_vacuum()
+        self.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL lets a second window or a script read while another one writes
+        self.cursor.execute("PRAGMA journal_mode = WAL")
+        self.cursor.execute("PRAGMA busy_timeout = 5000")
+
+    def _commit(self):
+        # Inside a bulk() block the commit happens once, when the block exits
+        if self._bulk_depth == 0:
+            self.conn.commit()
+
+    @contextmanager
+    def bulk(self):
+        """Groups many writes into a single transaction (used for imports and scripts)."""
+        if self._bulk_depth == 0 and not self.conn.in_transaction:
+            # Take the write lock before the first lookup, not at the first INSERT, so another
+            # connection (e.g. orphan cleanup) cannot delete a position between lookup and use
+            self.conn.execute("BEGIN IMMEDIATE")
+        self._bulk_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._bulk_depth -= 1
+            if self._bulk_depth == 0:
+                self.conn.rollback()
+            raise
+        self._bulk_depth -= 1
+        if self._bulk_depth == 0:
+            self.conn.commit()
 
     def create_tables(self):
         self.cursor.execute(
@@ -36,8 +75,85 @@ class ChessDatabase:
             "CREATE TABLE IF NOT EXISTS positions (id INTEGER PRIMARY KEY AUTOINCREMENT, fen TEXT UNIQUE NOT NULL)")
         self.cursor.execute(
             "CREATE TABLE IF NOT EXISTS moves (id INTEGER PRIMARY KEY AUTOINCREMENT, repertoire_id INTEGER, from_position_id INTEGER, to_position_id INTEGER, uci TEXT NOT NULL, comment TEXT, FOREIGN KEY(repertoire_id) REFERENCES repertoires(id), FOREIGN KEY(from_position_id) REFERENCES positions(id), FOREIGN KEY(to_position_id) REFERENCES positions(id))")
+        # Opponent replies waiting for engine analysis (see expansion.py)
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS expansion_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, repertoire_id INTEGER NOT NULL, fen TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', UNIQUE(repertoire_id, fen), FOREIGN KEY(repertoire_id) REFERENCES repertoires(id))")
+        # Lookups go both ways: children of a position, and which moves lead into a position
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_moves_from ON moves (from_position_id, repertoire_id, uci)")
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_moves_to ON moves (to_position_id, repertoire_id)")
+        # Whole-repertoire scans (loading, diff and merge)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_moves_repertoire ON moves (repertoire_id, from_position_id, uci)")
+        self.create_comment_index()
+        self.create_change_log()
         self.conn.commit()
 
+    def create_comment_index(self):
+        """
+        Full-text index over moves.comment (FTS5, external content).
+        Triggers keep it in sync with every insert/update/delete on moves,
+        so add_move, delete_move and delete_repertoire need no extra work.
+        """
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'move_comments'")
+        exists = self.cursor.fetchone() is not None
+        try:
+            self.cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS move_comments USING fts5(comment, content='moves', content_rowid='id')")
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search_comments falls back to LIKE
+            self.has_fts = False
+            return
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS moves_comment_insert AFTER INSERT ON moves BEGIN "
+            "INSERT INTO move_comments (rowid, comment) VALUES (new.id, new.comment); END")
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS moves_comment_delete AFTER DELETE ON moves BEGIN "
+            "INSERT INTO move_comments (move_comments, rowid, comment) VALUES ('delete', old.id, old.comment); END")
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS moves_comment_update AFTER UPDATE OF comment ON moves BEGIN "
+            "INSERT INTO move_comments (move_comments, rowid, comment) VALUES ('delete', old.id, old.comment); "
+            "INSERT INTO move_comments (rowid, comment) VALUES (new.id, new.comment); END")
+        if not exists:
+            # Index the comments written before the index existed
+            self.cursor.execute("INSERT INTO move_comments (move_comments) VALUES ('rebuild')")
+        self.has_fts = True
+
+    def create_change_log(self):
+        """
+        One row per repertoire, holding the id of its last change.
+        Triggers re-insert the row on every write, so AUTOINCREMENT turns the id
+        into a database-wide change counter that any connection can poll.
+        """
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS change_log (id INTEGER PRIMARY KEY AUTOINCREMENT, repertoire_id INTEGER UNIQUE NOT NULL)")
+        for name, table, when, rows in (
+                ("moves_changed_insert", "moves", "INSERT", ("new",)),
+                ("moves_changed_delete", "moves", "DELETE", ("old",)),
+                ("moves_changed_update", "moves", "UPDATE", ("old", "new")),
+                ("repertoires_changed_insert", "repertoires", "INSERT", ("new",)),
+                ("repertoires_changed_delete", "repertoires", "DELETE", ("old",)),
+                ("repertoires_changed_update", "repertoires", "UPDATE", ("new",))):
+            column = "repertoire_id" if table == "moves" else "id"
+            body = " ".join(f"INSERT OR REPLACE INTO change_log (repertoire_id) VALUES ({row}.{column});" for row in rows)
+            self.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {when} ON {table} BEGIN {body} END")
+
+    def data_version(self):
+        """Changes whenever another connection commits (our own commits do not count)."""
+        self.cursor.execute("PRAGMA data_version")
+        return self.cursor.fetchone()[0]
+
+    def last_change_id(self):
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM change_log")
+        return self.cursor.fetchone()[0]
+
+    def get_changed_repertoires(self, after_id):
+        """Returns (ids of repertoires changed after the given change id, newest change id)."""
+        self.cursor.execute("SELECT id, repertoire_id FROM change_log WHERE id > ?", (after_id,))
+        rows = self.cursor.fetchall()
+        return {row['repertoire_id'] for row in rows}, max([after_id] + [row['id'] for row in rows])
+
     def get_or_create_position(self, fen):
         fen_parts = fen.split(" ")
         clean_fen = " ".join(fen_parts[:4])
@@ -45,18 +161,19 @@ class ChessDatabase:
         row = self.cursor.fetchone()
         if row: return row['id']
         self.cursor.execute("INSERT INTO positions (fen) VALUES (?)", (clean_fen,))
-        self.conn.commit()
+        self._commit()
         return self.cursor.lastrowid
 
     def add_repertoire(self, name, color):
         self.cursor.execute("INSERT INTO repertoires (name, color) VALUES (?, ?)", (name, color))
-        self.conn.commit()
+        self._commit()
         return self.cursor.lastrowid
 
     def delete_repertoire(self, repertoire_id):
         self.cursor.execute("DELETE FROM moves WHERE repertoire_id = ?", (repertoire_id,))
+        self.cursor.execute("DELETE FROM expansion_jobs WHERE repertoire_id = ?", (repertoire_id,))
         self.cursor.execute("DELETE FROM repertoires WHERE id = ?", (repertoire_id,))
-        self.conn.commit()
+        self._commit()
 
     def get_repertoires(self):
         self.cursor.execute("SELECT * FROM repertoires")
@@ -68,6 +185,10 @@ class ChessDatabase:
         return row['color'] if row else 'White'
 
     def delete_move(self, move_id):
+        with self.bulk():
+            self._delete_move(move_id)
+
+    def _delete_move(self, move_id):
         self.cursor.execute("SELECT to_position_id, repertoire_id FROM moves WHERE id = ?", (move_id,))
         row = self.cursor.fetchone()
         if not row: return
@@ -77,9 +198,9 @@ class ChessDatabase:
                             (rep_id, to_pos_id))
         children = self.cursor.fetchall()
         for child in children:
-            self.delete_move(child['id'])
+            self._delete_move(child['id'])
         self.cursor.execute("DELETE FROM moves WHERE id = ?", (move_id,))
-        self.conn.commit()
+        self._commit()
 
     def get_move_by_id(self, move_id):
         self.cursor.execute("SELECT p.fen FROM moves m JOIN positions p ON m.to_position_id = p.id WHERE m.id = ?",
@@ -100,22 +221,22 @@ class ChessDatabase:
         return parent['fen'] if parent else None
 
     def add_move(self, repertoire_id, from_fen, to_fen, uci, comment=""):
-        from_id = self.get_or_create_position(from_fen)
-        to_id = self.get_or_create_position(to_fen)
-        self.cursor.execute("SELECT id FROM moves WHERE repertoire_id=? AND from_position_id=? AND uci=?",
-                            (repertoire_id, from_id, uci))
-        existing = self.cursor.fetchone()
-        if existing:
-            if comment:
-                self.cursor.execute("UPDATE moves SET comment=? WHERE id=?", (comment, existing['id']))
-                self.conn.commit()
-            return existing['id']
-        else:
-            self.cursor.execute(
-                "INSERT INTO moves (repertoire_id, from_position_id, to_position_id, uci, comment) VALUES (?, ?, ?, ?, ?)",
-                (repertoire_id, from_id, to_id, uci, comment))
-            self.conn.commit()
-            return self.cursor.lastrowid
+        # Positions and move are committed together, so maintenance never sees half an insert
+        with self.bulk():
+            from_id = self.get_or_create_position(from_fen)
+            to_id = self.get_or_create_position(to_fen)
+            self.cursor.execute("SELECT id FROM moves WHERE repertoire_id=? AND from_position_id=? AND uci=?",
+                                (repertoire_id, from_id, uci))
+            existing = self.cursor.fetchone()
+            if existing:
+                if comment:
+                    self.cursor.execute("UPDATE moves SET comment=? WHERE id=?", (comment, existing['id']))
+                return existing['id']
+            else:
+                self.cursor.execute(
+                    "INSERT INTO moves (repertoire_id, from_position_id, to_position_id, uci, comment) VALUES (?, ?, ?, ?, ?)",
+                    (repertoire_id, from_id, to_id, uci, comment))
+                return self.cursor.lastrowid
 
     def get_moves_from_fen(self, repertoire_id, fen):
         clean_fen = " ".join(fen.split(" ")[:4])
@@ -124,10 +245,357 @@ class ChessDatabase:
         if not row: return []
         from_id = row['id']
         self.cursor.execute(
-            "SELECT m.id, m.uci, m.comment, p.fen as to_fen FROM moves m JOIN positions p ON m.to_position_id = p.id WHERE m.repertoire_id = ? AND m.from_position_id = ?",
+            "SELECT m.id, m.uci, m.comment, p.fen as to_fen FROM moves m JOIN positions p ON m.to_position_id = p.id WHERE m.repertoire_id = ? AND m.from_position_id = ? ORDER BY m.id",
             (repertoire_id, from_id))
         return self.cursor.fetchall()
 
+    def get_repertoire_moves(self, repertoire_id):
+        """
+        Loads every move of a repertoire (with both FENs) in one query.
+        A FEN is None when the move points at a missing position.
+        """
+        self.cursor.execute(
+            "SELECT m.id, m.uci, m.comment, m.from_position_id, m.to_position_id, pf.fen AS from_fen, pt.fen AS to_fen "
+            "FROM moves m LEFT JOIN positions pf ON m.from_position_id = pf.id LEFT JOIN positions pt ON m.to_position_id = pt.id "
+            "WHERE m.repertoire_id = ? ORDER BY m.id",
+            (repertoire_id,))
+        return self.cursor.fetchall()
+
+    def diff_repertoires(self, repertoire_a, repertoire_b):
+        """
+        Compares two repertoires move by move (same start position and UCI).
+        Returns {'only_in_a': rows, 'only_in_b': rows, 'conflicts': rows}.
+        """
+        missing_sql = (
+            "SELECT m.id, m.uci, m.comment, pf.fen AS from_fen, pt.fen AS to_fen FROM moves m "
+            "JOIN positions pf ON m.from_position_id = pf.id JOIN positions pt ON m.to_position_id = pt.id "
+            "WHERE m.repertoire_id = ? AND NOT EXISTS (SELECT 1 FROM moves o WHERE o.from_position_id = m.from_position_id "
+            "AND o.repertoire_id = ? AND o.uci = m.uci) ORDER BY m.id")
+        self.cursor.execute(missing_sql, (repertoire_a, repertoire_b))
+        only_in_a = self.cursor.fetchall()
+        self.cursor.execute(missing_sql, (repertoire_b, repertoire_a))
+        only_in_b = self.cursor.fetchall()
+
+        self.cursor.execute(
+            "SELECT a.id AS id_a, b.id AS id_b, a.uci, a.comment AS comment_a, b.comment AS comment_b, pf.fen AS from_fen "
+            "FROM moves a JOIN moves b ON b.from_position_id = a.from_position_id AND b.repertoire_id = ? AND b.uci = a.uci "
+            "JOIN positions pf ON a.from_position_id = pf.id "
+            "WHERE a.repertoire_id = ? AND COALESCE(a.comment, '') != '' AND COALESCE(b.comment, '') != '' "
+            "AND a.comment != b.comment ORDER BY a.id",
+            (repertoire_b, repertoire_a))
+        conflicts = self.cursor.fetchall()
+        return {'only_in_a': only_in_a, 'only_in_b': only_in_b, 'conflicts': conflicts}
+
+    def merge_repertoires(self, source_id, target_id, overwrite_comments=False):
+        """
+        Copies every move of source into target in one transaction.
+        Comments fill empty target comments; with overwrite_comments they replace conflicting ones too.
+        Returns (moves_added, comments_updated).
+        """
+        source_comment = (
+            "SELECT s.comment FROM moves s WHERE s.from_position_id = moves.from_position_id "
+            "AND s.repertoire_id = ? AND s.uci = moves.uci AND COALESCE(s.comment, '') != '' ORDER BY s.id LIMIT 1")
+        only_empty = "" if overwrite_comments else "AND COALESCE(comment, '') = '' "
+        with self.bulk():
+            # Comments first, so the freshly copied moves are not counted twice
+            self.cursor.execute(
+                f"UPDATE moves SET comment = ({source_comment}) WHERE repertoire_id = ? {only_empty}"
+                f"AND ({source_comment}) IS NOT NULL AND COALESCE(comment, '') != ({source_comment})",
+                (source_id, target_id, source_id, source_id))
+            comments_updated = self.cursor.rowcount
+
+            # One row per (position, move) of the source, skipping what the target already has
+            self.cursor.execute(
+                "INSERT INTO moves (repertoire_id, from_position_id, to_position_id, uci, comment) "
+                "SELECT ?, m.from_position_id, m.to_position_id, m.uci, m.comment FROM moves m "
+                "WHERE m.id IN (SELECT MIN(id) FROM moves WHERE repertoire_id = ? GROUP BY from_position_id, uci) "
+                "AND NOT EXISTS (SELECT 1 FROM moves o WHERE o.from_position_id = m.from_position_id "
+                "AND o.repertoire_id = ? AND o.uci = m.uci) ORDER BY m.id",
+                (target_id, source_id, target_id))
+            moves_added = self.cursor.rowcount
+        return moves_added, comments_updated
+
+    def search_comments(self, text, repertoire_id=None, limit=50):
+        """
+        Finds moves whose comment matches every word of `text` (prefix match).
+        Returns rows with id, repertoire_id, name, uci, comment, snippet, from_fen, to_fen.
+        """
+        words = [w.replace('"', '') for w in text.split()]
+        words = [w for w in words if w]
+        if not words:
+            return []
+
+        select = ("SELECT m.id, m.repertoire_id, r.name, m.uci, m.comment, {snippet} AS snippet, "
+                  "pf.fen AS from_fen, pt.fen AS to_fen FROM {source} "
+                  "JOIN repertoires r ON m.repertoire_id = r.id "
+                  "JOIN positions pf ON m.from_position_id = pf.id JOIN positions pt ON m.to_position_id = pt.id ")
+        rep_filter = " AND m.repertoire_id = ?" if repertoire_id else ""
+        rep_params = (repertoire_id,) if repertoire_id else ()
+
+        if self.has_fts:
+            query = " ".join(f'"{w}"*' for w in words)
+            self.cursor.execute(
+                select.format(snippet="snippet(move_comments, 0, '', '', '...', 12)",
+                              source="move_comments JOIN moves m ON m.id = move_comments.rowid")
+                + "WHERE move_comments MATCH ?" + rep_filter + " ORDER BY rank LIMIT ?",
+                (query,) + rep_params + (limit,))
+        else:
+            like = " AND ".join("m.comment LIKE ?" for _ in words)
+            self.cursor.execute(
+                select.format(snippet="m.comment", source="moves m") + "WHERE " + like + rep_filter + " LIMIT ?",
+                tuple(f"%{w}%" for w in words) + rep_params + (limit,))
+        return self.cursor.fetchall()
+
+    def find_position_in_repertoires(self, fen, max_depth=60, max_paths=2000):
+        """
+        Finds every repertoire that reaches the given position and the move orders leading to it.
+        One recursive query collects, per repertoire, the distinct positions that lead to the
+        target (UNION, so transpositions cannot multiply the rows) and the moves between them.
+        The shortest move orders are then built from that subgraph, at most max_paths per
+        repertoire and none longer than max_depth.
+        Returns: {repertoire_id: {'name', 'color', 'paths': [uci strings]}}
+        """
+        clean_fen = " ".join(fen.split(" ")[:4])
+        result = {}
+
+        if clean_fen == START_FEN:
+            # Every repertoire "reaches" the start position; report the ones that continue from it
+            self.cursor.execute(
+                "SELECT DISTINCT r.id, r.name, r.color FROM repertoires r JOIN moves m ON m.repertoire_id = r.id "
+                "JOIN positions p ON m.from_position_id = p.id WHERE p.fen = ? ORDER BY r.name",
+                (START_FEN,))
+            for row in self.cursor.fetchall():
+                result[row['id']] = {'name': row['name'], 'color': row['color'], 'paths': [""]}
+            return result
+
+        self.cursor.execute("SELECT id FROM positions WHERE fen = ?", (START_FEN,))
+        row = self.cursor.fetchone()
+        if not row:
+            return result
+        root = row['id']
+
+        self.cursor.execute("""
+            WITH RECURSIVE
+                back(repertoire_id, position_id) AS (
+                    SELECT m.repertoire_id, m.to_position_id
+                    FROM moves m JOIN positions p ON m.to_position_id = p.id WHERE p.fen = ?
+                    UNION
+                    SELECT m.repertoire_id, m.from_position_id
+                    FROM back b JOIN moves m ON m.to_position_id = b.position_id AND m.repertoire_id = b.repertoire_id
+                    WHERE b.position_id != ?
+                )
+            SELECT m.repertoire_id, m.from_position_id, m.to_position_id, m.uci, r.name, r.color
+            FROM back b
+            JOIN moves m ON m.to_position_id = b.position_id AND m.repertoire_id = b.repertoire_id
+            JOIN repertoires r ON r.id = m.repertoire_id
+            WHERE b.position_id != ?
+            ORDER BY r.name, m.uci
+        """, (clean_fen, root, root))
+
+        graphs = {}
+        for row in self.cursor.fetchall():
+            graph = graphs.setdefault(row['repertoire_id'], {'name': row['name'], 'color': row['color'], 'into': {}})
+            graph['into'].setdefault(row['to_position_id'], []).append((row['from_position_id'], row['uci']))
+        self.cursor.execute("SELECT id FROM positions WHERE fen = ?", (clean_fen,))
+        target = self.cursor.fetchone()['id'] if graphs else None
+
+        for rep_id, graph in graphs.items():
+            paths = self._shortest_paths(graph['into'], root, target, max_depth, max_paths)
+            if paths:
+                result[rep_id] = {'name': graph['name'], 'color': graph['color'], 'paths': paths}
+        return result
+
+    @staticmethod
+    def _shortest_paths(into, root, target, max_depth, max_paths):
+        """Up to max_paths shortest move orders from root to target; into: {to_id: [(from_id, uci)]}."""
+        out = {}
+        for to_id, moves in into.items():
+            for from_id, _ in moves:
+                out.setdefault(from_id, []).append(to_id)
+        distance = {root: 0}
+        frontier = [root]
+        while frontier and target not in distance:
+            next_frontier = []
+            for node in frontier:
+                for child in out.get(node, ()):
+                    if child not in distance:
+                        distance[child] = distance[node] + 1
+                        next_frontier.append(child)
+            frontier = next_frontier
+        if target not in distance or distance[target] > max_depth:
+            return []
+
+        # Walk back along moves that shorten the distance by one; every such step reaches the root
+        paths = []
+        stack = [(target, [])]
+        while stack and len(paths) < max_paths:
+            node, path = stack.pop()
+            if node == root:
+                paths.append(" ".join(reversed(path)))
+                continue
+            for from_id, uci in reversed(into.get(node, ())):
+                if distance.get(from_id) == distance[node] - 1:
+                    stack.append((from_id, path + [uci]))
+        return sorted(paths)
+
+    def get_repertoire_stats(self, repertoire_id):
+        """Returns move, position and leaf counts for a repertoire."""
+        self.cursor.execute(
+            "SELECT COUNT(*) AS moves, COUNT(DISTINCT from_position_id) AS positions, "
+            "SUM(CASE WHEN comment IS NOT NULL AND comment != '' THEN 1 ELSE 0 END) AS comments "
+            "FROM moves WHERE repertoire_id = ?",
+            (repertoire_id,))
+        row = self.cursor.fetchone()
+        stats = {'moves': row['moves'], 'positions': row['positions'], 'comments': row['comments'] or 0}
+        stats['leaves'] = len(self.get_leaf_fens(repertoire_id))
+        return stats
+
+    def get_leaf_fens(self, repertoire_id):
+        """Returns the FENs reached by a move that has no continuation in the repertoire."""
+        self.cursor.execute(
+            "SELECT DISTINCT p.fen FROM moves m JOIN positions p ON m.to_position_id = p.id "
+            "WHERE m.repertoire_id = ? AND NOT EXISTS "
+            "(SELECT 1 FROM moves c WHERE c.repertoire_id = m.repertoire_id AND c.from_position_id = m.to_position_id)",
+            (repertoire_id,))
+        return [row['fen'] for row in self.cursor.fetchall()]
+
+    def repair_moves(self, delete_ids=(), retarget=(), duplicates=()):
+        """
+        Applies the repairs found by validator.py in one transaction.
+        retarget: [(move_id, correct_fen)]; duplicates: [(move_id, kept_move_id)],
+        a duplicate's comment is moved to the kept move if that one has none.
+        """
+        with self.bulk():
+            for move_id, fen in retarget:
+                self.cursor.execute("UPDATE moves SET to_position_id = ? WHERE id = ?",
+                                    (self.get_or_create_position(fen), move_id))
+            for move_id, kept_id in duplicates:
+                self.cursor.execute(
+                    "UPDATE moves SET comment = (SELECT comment FROM moves WHERE id = ?) "
+                    "WHERE id = ? AND COALESCE(comment, '') = ''",
+                    (move_id, kept_id))
+            ids = list(delete_ids) + [move_id for move_id, _ in duplicates]
+            self.cursor.executemany("DELETE FROM moves WHERE id = ?", [(move_id,) for move_id in ids])
+
+    # --- Expansion job queue ---
+    def queue_expansion_jobs(self, repertoire_id, fens):
+        """Adds positions to the expansion queue (positions already queued are kept as they are)."""
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO expansion_jobs (repertoire_id, fen) VALUES (?, ?)",
+            [(repertoire_id, fen) for fen in fens])
+        self._commit()
+
+    def get_pending_expansion_jobs(self, repertoire_id):
+        self.cursor.execute(
+            "SELECT id, fen FROM expansion_jobs WHERE repertoire_id = ? AND status = 'pending' ORDER BY id",
+            (repertoire_id,))
+        return self.cursor.fetchall()
+
+    def finish_expansion_job(self, job_id, status="done"):
+        self.cursor.execute("UPDATE expansion_jobs SET status = ? WHERE id = ?", (status, job_id))
+        self._commit()
+
+    def clear_expansion_jobs(self, repertoire_id):
+        self.cursor.execute("DELETE FROM expansion_jobs WHERE repertoire_id = ?", (repertoire_id,))
+        self._commit()
+
+    def vacuum(self):
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+
+    # --- Maintenance (see maintenance.py) ---
+    def incremental_vacuum_enabled(self):
+        """False for databases created before auto_vacuum = INCREMENTAL was set."""
+        self.cursor.execute("PRAGMA auto_vacuum")
+        return self.cursor.fetchone()[0] == 2
+
+    def free_pages(self):
+        self.cursor.execute("PRAGMA freelist_count")
+        return self.cursor.fetchone()[0]
+
+    def enable_incremental_vacuum(self):
+        """Switches an existing database to incremental auto-vacuum (needs one full VACUUM)."""
+        if not self.incremental_vacuum_enabled():
+            self.conn.commit()
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("VACUUM")
+
+    def delete_orphan_positions(self, after_id, limit=500):
+        """
+        Deletes positions no move refers to, scanning `limit` position ids after `after_id`.
+        Returns (deleted, last_id); last_id is None once the whole table was scanned.
+        """
+        self.cursor.execute("SELECT id FROM positions WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+        ids = [row['id'] for row in self.cursor.fetchall()]
+        if not ids:
+            return 0, None
+        self.cursor.execute(
+            "DELETE FROM positions WHERE id > ? AND id <= ? "
+            "AND NOT EXISTS (SELECT 1 FROM moves WHERE from_position_id = positions.id) "
+            "AND NOT EXISTS (SELECT 1 FROM moves WHERE to_position_id = positions.id)",
+            (after_id, ids[-1]))
+        deleted = self.cursor.rowcount
+        self._commit()
+        return deleted, ids[-1]
+
+    def optimize(self):
+        """Refreshes query planner statistics (bounded, so it stays quick on large files)."""
+        self.cursor.execute("PRAGMA analysis_limit = 400")
+        self.cursor.execute("ANALYZE")
+        self.cursor.execute("PRAGMA optimize")
+        self.conn.commit()
+
+    def incremental_vacuum(self, pages=64):
+        """Returns up to `pages` free pages to the file system. Returns the pages still free."""
+        if not self.incremental_vacuum_enabled():
+            return 0
+        self.conn.commit()
+        self.cursor.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+        self.cursor.fetchall()
+        return self.free_pages()
+
+    def check_move_references(self, after_id, limit=500):
+        """
+        Finds moves pointing at a missing repertoire or position, scanning `limit` move ids after `after_id`.
+        Returns (problems, last_id); last_id is None once the whole table was scanned.
+        """
+        self.cursor.execute("SELECT id FROM moves WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+        ids = [row['id'] for row in self.cursor.fetchall()]
+        if not ids:
+            return [], None
+        self.cursor.execute(
+            "SELECT m.id, r.id IS NULL AS no_rep, f.id IS NULL AS no_from, t.id IS NULL AS no_to FROM moves m "
+            "LEFT JOIN repertoires r ON r.id = m.repertoire_id "
+            "LEFT JOIN positions f ON f.id = m.from_position_id "
+            "LEFT JOIN positions t ON t.id = m.to_position_id "
+            "WHERE m.id > ? AND m.id <= ? AND (r.id IS NULL OR f.id IS NULL OR t.id IS NULL)",
+            (after_id, ids[-1]))
+        problems = []
+        for row in self.cursor.fetchall():
+            missing = [name for name, flag in (("repertoire", row['no_rep']), ("from position", row['no_from']),
+                                               ("to position", row['no_to'])) if flag]
+            problems.append(f"moves row {row['id']} references missing {', '.join(missing)}")
+        return problems, ids[-1]
+
+    def table_size(self, table):
+        """Upper bound of a table's row count (its largest rowid), without scanning it."""
+        self.cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}")
+        return self.cursor.fetchone()[0]
+
+    def check_integrity(self, table=None, foreign_keys=True):
+        """Runs PRAGMA quick_check and foreign_key_check (on a single table when given). Returns a list of problems."""
+        try:
+            self.cursor.execute(f"PRAGMA quick_check({table})" if table else "PRAGMA quick_check")
+        except sqlite3.OperationalError:
+            # Per-table checks need SQLite 3.33
+            self.cursor.execute("PRAGMA quick_check")
+        problems = [row[0] for row in self.cursor.fetchall() if row[0] != "ok"]
+        if not foreign_keys:
+            return problems
+        self.cursor.execute("PRAGMA foreign_key_check" + (f"({table})" if table else ""))
+        problems += [f"{row[0]} row {row[1]} references missing {row[2]}" for row in self.cursor.fetchall()]
+        return problems
+
     def close(self):
         if self.conn:
             self.conn.close()
\ No newline at end of file
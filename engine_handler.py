@@ -1,11 +1,75 @@
 import chess.engine
 import os
+import sys
+import threading
+import time
+from collections import deque
+
+
+def get_resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, relative_path)
+
+
+def default_engine_path():
+    """Path of the bundled Stockfish binary."""
+    return get_resource_path(os.path.join("engines", "stockfish"))
+
+
+DEFAULT_HASH_MB = 128
+
+
+def default_threads():
+    """Half the cores, leaving the rest to the GUI and background jobs."""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class AdaptiveSettings:
+    """Budget for get_evaluation(adaptive=True)."""
+
+    def __init__(self, stable_depths=4, score_margin=20, min_depth=8, max_depth=40,
+                 soft_time=0.5, max_time=3.0):
+        self.stable_depths = stable_depths  # stop once best move and score held for this many depths
+        self.score_margin = score_margin    # centipawns a score may move and still count as stable
+        self.min_depth = min_depth          # never stop before this depth
+        self.max_depth = max_depth
+        self.soft_time = soft_time          # past this, stop as soon as the last depth was stable
+        self.max_time = max_time            # unstable positions may extend up to this
 
 
 class EngineHandler:
-    def __init__(self, engine_path):
+    def __init__(self, engine_path, threads=None, hash_mb=None, multipv=1):
         self.engine_path = engine_path
         self.engine = None
+        # One engine process runs one search at a time; background users (prefetch) share it through this lock
+        self.lock = threading.RLock()
+        self.options = {}
+        self.multipv = 1
+        self.adaptive = AdaptiveSettings()
+        # Telemetry: the latest search and a short history
+        self.last_search = None
+        self.search_log = deque(maxlen=100)
+        self.configure(threads=threads, hash_mb=hash_mb, multipv=multipv)
+
+    def configure(self, threads=None, hash_mb=None, multipv=None):
+        """Sets Threads/Hash (applied now if running, else on start) and the MultiPV count."""
+        if threads:
+            self.options["Threads"] = threads
+        if hash_mb:
+            self.options["Hash"] = hash_mb
+        if multipv:
+            # MultiPV is managed per search by python-chess, not as an engine option
+            self.multipv = multipv
+        if self.engine:
+            supported = {k: v for k, v in self.options.items() if k in self.engine.options}
+            if supported:
+                with self.lock:
+                    self.engine.configure(supported)
 
     def start_engine(self):
         if not os.path.exists(self.engine_path):
@@ -14,20 +78,96 @@ class EngineHandler:
         # Start the process
         try:
             self.engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+            self.configure()
 
         except Exception as e:
             print(f"Failed to start engine: {e}")
             raise e
 
-    def get_evaluation(self, fen, time_limit=0.1):
-        """Returns info about the position (score, best move)."""
+    def get_evaluation(self, fen, time_limit=0.1, adaptive=False, record=True, multipv=None):
+        """
+        Returns info about the position (score, best move).
+        Like python-chess, returns a list of infos (best line first) when more than one line
+        is searched: multipv, or the handler's MultiPV setting if not given.
+        With adaptive=True the search deepens until the result is stable (see analyse_adaptive).
+        record=False keeps background searches out of last_search / search_log.
+        """
         if not self.engine:
             return None
 
+        multipv = multipv or self.multipv
+        if adaptive:
+            return self.analyse_adaptive(fen, record=record, multipv=multipv)
+
         board = chess.Board(fen)
-        # analyse returns a dictionary of info
-        info = self.engine.analyse(board, chess.engine.Limit(time=time_limit))
-        return info
+        started = time.monotonic()
+        with self.lock:
+            lines = self.engine.analyse(board, chess.engine.Limit(time=time_limit), multipv=multipv)
+        if record:
+            self._record_search(lines[0], started, "time", 0)
+        return lines if multipv > 1 else lines[0]
+
+    def analyse_adaptive(self, fen, settings=None, record=True, multipv=None):
+        """
+        Iterative deepening with a stability-based stop: the search ends once the
+        best move and score have held for `stable_depths` depths, or after
+        `soft_time` if the last depth agreed with the one before. Unstable
+        positions keep searching up to `max_time` / `max_depth`.
+        """
+        if not self.engine:
+            return None
+
+        settings = settings or self.adaptive
+        multipv = multipv or self.multipv
+        board = chess.Board(fen)
+        limit = chess.engine.Limit(depth=settings.max_depth, time=settings.max_time)
+        started = time.monotonic()
+        last_depth = 0
+        last_move = None
+        last_score = None
+        stable = 0
+        reason = "limit"
+
+        with self.lock, self.engine.analysis(board, limit, multipv=multipv) as analysis:
+            for info in analysis:
+                depth = info.get("depth")
+                # Only complete principal variations of the best line mark a finished depth
+                if (not depth or depth <= last_depth or info.get("multipv", 1) != 1 or not info.get("pv")
+                        or "score" not in info or info.get("lowerbound") or info.get("upperbound")):
+                    continue
+                move = info["pv"][0]
+                score = info["score"].relative.score(mate_score=100000)
+                if move == last_move and abs(score - last_score) <= settings.score_margin:
+                    stable += 1
+                else:
+                    stable = 0
+                last_depth, last_move, last_score = depth, move, score
+
+                if depth < settings.min_depth:
+                    continue
+                if stable >= settings.stable_depths:
+                    reason = "stable"
+                    break
+                if stable and time.monotonic() - started >= settings.soft_time:
+                    reason = "soft_time"
+                    break
+            analysis.stop()
+            lines = list(analysis.multipv) if analysis.multipv else [analysis.info]
+
+        if record:
+            self._record_search(lines[0], started, reason, stable)
+        return lines if multipv > 1 else lines[0]
+
+    def _record_search(self, info, started, reason, stable):
+        self.last_search = {
+            "depth": info.get("depth"),
+            "seldepth": info.get("seldepth"),
+            "nodes": info.get("nodes"),
+            "time": time.monotonic() - started,
+            "stable_depths": stable,
+            "stopped_by": reason,
+        }
+        self.search_log.append(self.last_search)
 
     def get_best_move(self, fen, time_limit=0.1):
         """Returns just the best move object."""
@@ -35,9 +175,33 @@ class EngineHandler:
             return None
 
         board = chess.Board(fen)
-        result = self.engine.play(board, chess.engine.Limit(time=time_limit))
+        with self.lock:
+            result = self.engine.play(board, chess.engine.Limit(time=time_limit))
         return result.move
 
+    def get_top_moves(self, fen, count=3, depth=None, time_limit=0.5):
+        """
+        Returns the engine's `count` best moves as [(move, centipawns), ...],
+        scores from the point of view of the side to move. Uses depth if given.
+        """
+        if not self.engine:
+            return []
+
+        board = chess.Board(fen)
+        limit = chess.engine.Limit(depth=depth) if depth else chess.engine.Limit(time=time_limit)
+        with self.lock:
+            infos = self.engine.analyse(board, limit, multipv=count)
+        if not isinstance(infos, list):
+            infos = [infos]
+        top = []
+        for info in infos:
+            if "pv" not in info or not info["pv"]:
+                continue
+            score = info["score"].pov(board.turn).score(mate_score=100000)
+            top.append((info["pv"][0], score))
+        return top
+
     def stop_engine(self):
         if self.engine:
-            self.engine.quit()
\ No newline at end of file
+            with self.lock:
+                self.engine.quit()
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Engine-driven expansion of the opponent's side of a repertoire.
+
+Every leaf where the opponent is to move becomes a job in the `expansion_jobs`
+table. Worker threads (one engine process each) run MultiPV analysis on the
+jobs and the expander writes the good replies back in batches. Jobs are only
+marked done once their replies are committed, so an interrupted expansion
+resumes where it stopped the next time it runs. A finished job is never
+analysed again unless the expansion is restarted (settings.restart), e.g.
+with a different depth or score threshold.
+"""
+import os
+import queue
+import threading
+
+import chess
+
+from database import ChessDatabase
+from engine_handler import EngineHandler
+
+
+class ExpansionSettings:
+    def __init__(self, top_n=3, min_score=-100, depth=18, workers=2, batch_size=20, restart=False):
+        self.top_n = top_n            # replies kept per position
+        self.min_score = min_score    # centipawns, from the opponent's point of view
+        self.depth = depth            # engine search depth
+        self.workers = workers        # engine processes running in parallel
+        self.batch_size = batch_size  # jobs written per transaction
+        self.restart = restart        # forget finished jobs, so every current leaf is analysed again
+
+
+class RepertoireExpander:
+    def __init__(self, db_path, engine_path, repertoire_id, settings=None):
+        self.db_path = db_path
+        self.engine_path = engine_path
+        self.repertoire_id = repertoire_id
+        self.settings = settings or ExpansionSettings()
+        self.stop_event = threading.Event()
+
+        # Progress, readable from other threads
+        self.total = 0
+        self.done = 0
+        self.added = 0
+        self.error = None
+
+    def _open_database(self):
+        folder, filename = os.path.split(self.db_path)
+        return ChessDatabase(filename, data_folder=folder, verbose=False)
+
+    def queue_leaves(self, db):
+        """Queues every leaf of the repertoire where the opponent is to move."""
+        color = db.get_repertoire_color(self.repertoire_id)
+        opponent = "b" if color == "White" else "w"
+        fens = [fen for fen in db.get_leaf_fens(self.repertoire_id) if fen.split(" ")[1] == opponent]
+        db.queue_expansion_jobs(self.repertoire_id, fens)
+        return len(fens)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        """Processes all pending jobs. Safe to call from a background thread."""
+        db = self._open_database()
+        engines = []
+        try:
+            if self.settings.restart:
+                db.clear_expansion_jobs(self.repertoire_id)
+            self.queue_leaves(db)
+            jobs = db.get_pending_expansion_jobs(self.repertoire_id)
+            self.total = len(jobs)
+            if not jobs:
+                return
+
+            for _ in range(min(self.settings.workers, len(jobs))):
+                engine = EngineHandler(self.engine_path)
+                engine.start_engine()
+                engines.append(engine)
+
+            job_queue = queue.Queue()
+            for job in jobs:
+                job_queue.put((job['id'], job['fen']))
+            results = queue.Queue()
+            threads = [threading.Thread(target=self._worker, args=(engine, job_queue, results), daemon=True)
+                       for engine in engines]
+            for thread in threads:
+                thread.start()
+
+            batch = []
+            while self.done + len(batch) < self.total and not self.stop_event.is_set():
+                try:
+                    batch.append(results.get(timeout=0.2))
+                except queue.Empty:
+                    if not any(thread.is_alive() for thread in threads):
+                        break
+                    continue
+                if len(batch) >= self.settings.batch_size:
+                    self._write_batch(db, batch)
+                    batch = []
+            self._write_batch(db, batch)
+
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+        except Exception as e:
+            self.error = e
+        finally:
+            # A crashed engine raises on quit; that must not keep the others running or the database open
+            for engine in engines:
+                try:
+                    engine.stop_engine()
+                except Exception as e:
+                    self.error = self.error or e
+            try:
+                db.close()
+            except Exception as e:
+                self.error = self.error or e
+
+    def _worker(self, engine, job_queue, results):
+        while not self.stop_event.is_set():
+            try:
+                job_id, fen = job_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                top = engine.get_top_moves(fen, self.settings.top_n, depth=self.settings.depth)
+            except Exception as e:
+                # Leave the job pending; it is retried on the next run
+                self.error = e
+                return
+            replies = [move for move, score in top if score >= self.settings.min_score]
+            results.put((job_id, fen, replies))
+
+    def _write_batch(self, db, batch):
+        if not batch:
+            return
+        added = 0
+        with db.bulk():
+            for job_id, fen, replies in batch:
+                board = chess.Board(fen)
+                for move in replies:
+                    board.push(move)
+                    db.add_move(self.repertoire_id, fen, board.fen(), move.uci())
+                    board.pop()
+                    added += 1
+                db.finish_expansion_job(job_id)
+        self.added += added
+        self.done += len(batch)
@@ -1,12 +1,23 @@
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                              QLabel, QTextEdit, QComboBox, QMessageBox, QDialog,
-                             QLineEdit, QDialogButtonBox)
-from PyQt6.QtCore import Qt, QTimer
+                             QLineEdit, QDialogButtonBox, QTextBrowser, QListWidget,
+                             QListWidgetItem, QFileDialog, QInputDialog, QSpinBox,
+                             QFormLayout, QCheckBox)
+from PyQt6.QtCore import Qt, QTimer, QSettings
 import chess
 import chess.svg
 from board_widget import InteractiveBoard
 from move_display import MoveDisplay
 from trainer import RepertoireTrainer
+from snapshot import export_snapshot, import_snapshot, SnapshotTree, SnapshotError
+from expansion import RepertoireExpander, ExpansionSettings
+from maintenance import DatabaseMaintenance, check_tables
+from prefetch import PositionPrefetcher
+from validator import validate_all, validate_repertoire, repair_repertoire
+from engine_handler import DEFAULT_HASH_MB, default_threads
+import os
+import threading
+import time
 
 
 class NewRepertoireDialog(QDialog):
@@ -39,7 +50,107 @@ class NewRepertoireDialog(QDialog):
         return self.name_input.text(), self.color_input.currentText()
 
 
+class ExpandDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Expand Opponent Replies")
+        self.setFixedWidth(300)
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        form = QFormLayout()
+        defaults = ExpansionSettings()
+        self.top_input = QSpinBox()
+        self.top_input.setRange(1, 10)
+        self.top_input.setValue(defaults.top_n)
+        form.addRow("Replies per position:", self.top_input)
+        self.score_input = QSpinBox()
+        self.score_input.setRange(-1000, 1000)
+        self.score_input.setValue(defaults.min_score)
+        form.addRow("Min. score (cp):", self.score_input)
+        self.depth_input = QSpinBox()
+        self.depth_input.setRange(1, 40)
+        self.depth_input.setValue(defaults.depth)
+        form.addRow("Depth:", self.depth_input)
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, 16)
+        self.workers_input.setValue(defaults.workers)
+        form.addRow("Engines:", self.workers_input)
+        layout.addLayout(form)
+        self.restart_input = QCheckBox("Re-analyse positions expanded before")
+        layout.addWidget(self.restart_input)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+
+    def get_settings(self):
+        return ExpansionSettings(top_n=self.top_input.value(), min_score=self.score_input.value(),
+                                 depth=self.depth_input.value(), workers=self.workers_input.value(),
+                                 restart=self.restart_input.isChecked())
+
+
+def load_engine_settings():
+    """Engine options saved by EngineSettingsDialog, as EngineHandler keyword arguments."""
+    settings = QSettings("ChessForge", "ChessForge")
+    return {
+        "threads": settings.value("engine/threads", default_threads(), type=int),
+        "hash_mb": settings.value("engine/hash_mb", DEFAULT_HASH_MB, type=int),
+        "multipv": settings.value("engine/multipv", 1, type=int),
+    }
+
+
+class EngineSettingsDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Engine Settings")
+        self.setFixedWidth(300)
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        form = QFormLayout()
+        current = load_engine_settings()
+        self.threads_input = QSpinBox()
+        self.threads_input.setRange(1, os.cpu_count() or 1)
+        self.threads_input.setValue(current["threads"])
+        form.addRow("Threads:", self.threads_input)
+        self.hash_input = QSpinBox()
+        self.hash_input.setRange(16, 4096)
+        self.hash_input.setSingleStep(16)
+        self.hash_input.setValue(current["hash_mb"])
+        form.addRow("Hash (MB):", self.hash_input)
+        self.multipv_input = QSpinBox()
+        self.multipv_input.setRange(1, 10)
+        self.multipv_input.setValue(current["multipv"])
+        form.addRow("Lines (MultiPV):", self.multipv_input)
+        layout.addLayout(form)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+
+    def save(self):
+        """Stores the values and returns them as EngineHandler.configure() keyword arguments."""
+        values = {"threads": self.threads_input.value(), "hash_mb": self.hash_input.value(),
+                  "multipv": self.multipv_input.value()}
+        settings = QSettings("ChessForge", "ChessForge")
+        for key, value in values.items():
+            settings.setValue(f"engine/{key}", value)
+        return values
+
+
 class ChessWindow(QWidget):
+    MAINTENANCE_INTERVAL_MS = 30 * 60 * 1000
+    MAINTENANCE_IDLE_SECONDS = 3
+    CHANGE_POLL_MS = 1000
+    # Reload once a writer has been quiet this long, but never wait longer than the max delay
+    CHANGE_SETTLE_SECONDS = 2
+    CHANGE_MAX_DELAY_SECONDS = 30
+
     def __init__(self, engine_handler, database):
         super().__init__()
         self.engine_handler = engine_handler
@@ -47,9 +158,30 @@ class ChessWindow(QWidget):
         self.trainer = RepertoireTrainer(database)
         self.board = chess.Board()
         self.current_repertoire_id = None
+        # Read-only SnapshotTree shown instead of a repertoire (see open_snapshot_dialog)
+        self.snapshot = None
         self.is_training = False
 
         self.redo_stack = []
+        self.lookup_fen = None
+        self.expander = None
+        self.expander_thread = None
+        self.engine_thread = None
+        self.engine_result = None
+        self.validation_thread = None
+        self.validation_reports = None
+        self.maintenance = DatabaseMaintenance(database)
+        self.check_thread = None
+        self.check_problems = None
+        self.vacuum_offered = False
+        self.prefetcher = PositionPrefetcher(engine_handler)
+        self.prefetch_fen = None
+        self.last_activity = time.monotonic()
+        self.db_version = None
+        self.last_change_id = 0
+        self.pending_changes = set()
+        self.first_pending_change = 0
+        self.last_pending_change = 0
 
         self.setWindowTitle("ChessForge")
         self.setGeometry(100, 100, 1100, 700)
@@ -65,6 +197,9 @@ class ChessWindow(QWidget):
         self.board_widget = InteractiveBoard(self.board)
         self.board_widget.setMinimumSize(400, 400)
         self.board_widget.move_played.connect(self.on_board_move)
+        self.board_widget.board_updated.connect(self.update_position_lookup)
+        self.board_widget.board_updated.connect(self.note_activity)
+        self.board_widget.board_updated.connect(self.prefetch_position)
 
         self.board_layout.addWidget(self.board_widget)
 
@@ -105,6 +240,15 @@ class ChessWindow(QWidget):
         self.move_display.delete_requested.connect(self.on_delete_move)
 
         self.tree_layout.addWidget(self.move_display)
+
+        # Which repertoires reach the current position (and how)
+        self.tree_layout.addWidget(QLabel("<b>Position also in:</b>"))
+        self.lookup_display = QTextBrowser()
+        self.lookup_display.setOpenLinks(False)
+        self.lookup_display.setMaximumHeight(150)
+        self.lookup_display.anchorClicked.connect(self.on_lookup_clicked)
+        self.tree_layout.addWidget(self.lookup_display)
+
         self.main_layout.addWidget(self.tree_container)
 
         # --- RIGHT: CONTROLS ---
@@ -141,6 +285,22 @@ class ChessWindow(QWidget):
         self.btn_delete_rep.setStyleSheet("color: #c00;")
         self.controls_layout.addWidget(self.btn_delete_rep)
 
+        self.btn_merge_rep = QPushButton("Merge Into Current...")
+        self.btn_merge_rep.clicked.connect(self.merge_repertoire_dialog)
+        self.controls_layout.addWidget(self.btn_merge_rep)
+
+        snapshot_layout = QHBoxLayout()
+        self.btn_export_snapshot = QPushButton("Export Snapshot")
+        self.btn_export_snapshot.clicked.connect(self.export_snapshot_dialog)
+        snapshot_layout.addWidget(self.btn_export_snapshot)
+        self.btn_import_snapshot = QPushButton("Import Snapshot")
+        self.btn_import_snapshot.clicked.connect(self.import_snapshot_dialog)
+        snapshot_layout.addWidget(self.btn_import_snapshot)
+        self.controls_layout.addLayout(snapshot_layout)
+        self.btn_open_snapshot = QPushButton("Open Snapshot (Read-Only)")
+        self.btn_open_snapshot.clicked.connect(self.toggle_snapshot)
+        self.controls_layout.addWidget(self.btn_open_snapshot)
+
         self.controls_layout.addSpacing(20)
 
         self.controls_layout.addWidget(QLabel("<b>Comment:</b>"))
@@ -148,10 +308,67 @@ class ChessWindow(QWidget):
         self.comment_box.setMaximumHeight(100)
         self.controls_layout.addWidget(self.comment_box)
 
+        self.controls_layout.addSpacing(10)
+
+        self.controls_layout.addWidget(QLabel("<b>Search Comments:</b>"))
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Words from a comment...")
+        self.search_input.returnPressed.connect(self.search_comments)
+        self.controls_layout.addWidget(self.search_input)
+        self.search_results = QListWidget()
+        self.search_results.setMaximumHeight(120)
+        self.search_results.itemClicked.connect(self.on_search_result_clicked)
+        self.controls_layout.addWidget(self.search_results)
+
         self.controls_layout.addSpacing(20)
         self.btn_analyze = QPushButton("Ask Stockfish")
         self.btn_analyze.clicked.connect(self.ask_engine)
         self.controls_layout.addWidget(self.btn_analyze)
+        self.btn_engine_settings = QPushButton("Engine Settings...")
+        self.btn_engine_settings.clicked.connect(self.engine_settings_dialog)
+        self.controls_layout.addWidget(self.btn_engine_settings)
+
+        self.chk_live_eval = QCheckBox("Live evaluation")
+        self.chk_live_eval.toggled.connect(self.toggle_live_evaluation)
+        self.controls_layout.addWidget(self.chk_live_eval)
+        self.eval_label = QLabel("")
+        self.controls_layout.addWidget(self.eval_label)
+        self.eval_timer = QTimer(self)
+        self.eval_timer.setInterval(200)
+        self.eval_timer.timeout.connect(self.show_live_evaluation)
+
+        self.btn_expand = QPushButton("Expand Opponent Replies")
+        self.btn_expand.clicked.connect(self.toggle_expansion)
+        self.controls_layout.addWidget(self.btn_expand)
+
+        self.expansion_timer = QTimer(self)
+        self.expansion_timer.setInterval(500)
+        self.expansion_timer.timeout.connect(self.poll_expansion)
+
+        # "Ask Stockfish" searches on a worker thread (adaptive searches can take seconds)
+        self.engine_timer = QTimer(self)
+        self.engine_timer.setInterval(100)
+        self.engine_timer.timeout.connect(self.poll_engine_search)
+
+        self.validation_timer = QTimer(self)
+        self.validation_timer.setInterval(200)
+        self.validation_timer.timeout.connect(self.poll_validation)
+
+        # Maintenance runs in slices of a few ms while the user is idle
+        self.maintenance_timer = QTimer(self)
+        self.maintenance_timer.setInterval(100)
+        self.maintenance_timer.timeout.connect(self.run_maintenance_slice)
+        self.check_timer = QTimer(self)
+        self.check_timer.setInterval(500)
+        self.check_timer.timeout.connect(self.poll_table_checks)
+        self.maintenance_schedule = QTimer(self)
+        self.maintenance_schedule.setInterval(self.MAINTENANCE_INTERVAL_MS)
+        self.maintenance_schedule.timeout.connect(self.start_maintenance)
+
+        # Picks up changes made by other windows, scripts or the expander
+        self.change_timer = QTimer(self)
+        self.change_timer.setInterval(self.CHANGE_POLL_MS)
+        self.change_timer.timeout.connect(self.poll_database_changes)
 
         self.console_output = QTextEdit()
         self.console_output.setReadOnly(True)
@@ -160,8 +377,315 @@ class ChessWindow(QWidget):
         self.main_layout.addWidget(self.controls_container)
         self.board_widget.update_board()
 
+    # --- COMMENT SEARCH ---
+    def search_comments(self):
+        self.search_results.clear()
+        text = self.search_input.text().strip()
+        if not text:
+            return
+        rows = self.db.search_comments(text)
+        if not rows:
+            self.search_results.addItem("No matches.")
+            return
+        for row in rows:
+            try:
+                san = chess.Board(row['from_fen']).san(chess.Move.from_uci(row['uci']))
+            except ValueError:
+                san = row['uci']
+            item = QListWidgetItem(f"{row['name']}: {san} - {row['snippet']}")
+            item.setToolTip(row['comment'])
+            item.setData(Qt.ItemDataRole.UserRole, (row['repertoire_id'], row['to_fen']))
+            self.search_results.addItem(item)
+
+    def on_search_result_clicked(self, item):
+        """Switches to the result's repertoire and shows the position after the commented move."""
+        data = item.data(Qt.ItemDataRole.UserRole)
+        if not data or self.is_training:
+            return
+        rep_id, fen = data
+        index = self.combo_repertoire.findData(rep_id)
+        if index >= 0 and index != self.combo_repertoire.currentIndex():
+            self.combo_repertoire.setCurrentIndex(index)
+        self.board.set_fen(fen)
+        self.redo_stack.clear()
+        self.board_widget.update_board()
+        self.status_label.setText("Jumped to position")
+
+    # --- CROSS-REPERTOIRE LOOKUP ---
+    def update_position_lookup(self):
+        """Lists the repertoires that reach the current position, with their move orders."""
+        fen = self.board.fen()
+        if self.is_training or fen == self.lookup_fen:
+            return
+        self.lookup_fen = fen
+
+        matches = self.db.find_position_in_repertoires(fen, max_paths=5)
+        if not matches:
+            self.lookup_display.setHtml("<span style='color:#666'>Not in any repertoire.</span>")
+            return
+
+        html = ""
+        for rep_id, entry in matches.items():
+            html += f"<b>{entry['name']} ({entry['color']})</b><ul style='margin-top:0px'>"
+            for path in entry['paths']:
+                ucis = path.split()
+                try:
+                    line = chess.Board().variation_san([chess.Move.from_uci(u) for u in ucis]) or "Start position"
+                except ValueError:
+                    continue
+                html += f"<li><a href='line:{rep_id}:{'+'.join(ucis)}'>{line}</a></li>"
+            html += "</ul>"
+        self.lookup_display.setHtml(html)
+
+    def on_lookup_clicked(self, url):
+        """Switches to the clicked repertoire and replays the move order."""
+        if self.is_training:
+            return
+        _, rep_id, path = url.toString().split(":", 2)
+        index = self.combo_repertoire.findData(int(rep_id))
+        if index < 0:
+            return
+        if index != self.combo_repertoire.currentIndex():
+            self.combo_repertoire.setCurrentIndex(index)
+        self.board.reset()
+        self.redo_stack.clear()
+        for uci in filter(None, path.split("+")):
+            self.board.push(chess.Move.from_uci(uci))
+        self.board_widget.update_board()
+        self.status_label.setText("Jumped to position")
+
     def initial_load(self):
         self.refresh_repertoires()
+        QTimer.singleShot(0, self.validate_repertoires)
+        # First maintenance cycle shortly after startup, then periodically
+        QTimer.singleShot(60 * 1000, self.start_maintenance)
+        self.maintenance_schedule.start()
+        self.db_version = self.db.data_version()
+        self.last_change_id = self.db.last_change_id()
+        self.change_timer.start()
+
+    # --- PREFETCH / LIVE EVALUATION ---
+    def prefetch_position(self):
+        """Keeps the repertoire tree warm and queues evaluations for the next few plies."""
+        fen = self.board.fen()
+        if fen == self.prefetch_fen:
+            return
+        self.prefetch_fen = fen
+        tree = self.current_tree()
+        if self.chk_live_eval.isChecked() and not self.is_training:
+            self.prefetcher.prefetch(self.board, tree)
+            self.show_live_evaluation()
+
+    def toggle_live_evaluation(self, checked):
+        if checked:
+            self.prefetch_fen = None
+            self.prefetch_position()
+        else:
+            self.prefetcher.cancel()
+            self.eval_timer.stop()
+            self.eval_label.setText("")
+
+    def show_live_evaluation(self):
+        info = self.prefetcher.get_evaluation(self.board.fen())
+        if not info:
+            self.eval_label.setText("Eval: ...")
+            self.eval_timer.start()
+            return
+        self.eval_timer.stop()
+        best_move = info["pv"][0] if info.get("pv") else None
+        san = self.board.san(best_move) if best_move and self.board.is_legal(best_move) else "-"
+        self.eval_label.setText(f"Eval: {info['score'].white()} ({san}, depth {info.get('depth')})")
+
+    # --- STARTUP VALIDATION ---
+    def validate_repertoires(self):
+        """Checks every repertoire for corrupt moves on a worker thread; poll_validation offers the repair."""
+        if self.validation_thread:
+            return
+        self.validation_reports = None
+        self.validation_thread = threading.Thread(target=self.run_validation, daemon=True)
+        self.validation_thread.start()
+        self.validation_timer.start()
+
+    def run_validation(self):
+        # Worker thread: opens its own connection, the GUI one stays on the GUI thread
+        try:
+            self.validation_reports = validate_all(self.db.db_path)
+        except Exception as e:
+            self.validation_reports = e
+
+    def poll_validation(self):
+        if self.validation_thread.is_alive():
+            return
+        self.validation_timer.stop()
+        self.validation_thread = None
+        if isinstance(self.validation_reports, Exception):
+            self.console_output.append(f"Repertoire check failed: {self.validation_reports}")
+            return
+        reports = [r for r in self.validation_reports if r.issue_count]
+        if not reports:
+            return
+        names = {r['id']: r['name'] for r in self.db.get_repertoires()}
+        # A repertoire may have been deleted while the check ran
+        reports = [r for r in reports if r.repertoire_id in names]
+        if not reports:
+            return
+        details = "\n".join(f"{names[r.repertoire_id]}: {r.summary()}" for r in reports)
+        reply = QMessageBox.question(self, "Repertoire Check",
+                                     f"Some stored moves are inconsistent:\n{details}\n\nRepair them now?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        repaired = 0
+        for report in reports:
+            # The report may be stale (moves added or connected since), so repair from a fresh one
+            report = validate_repertoire(self.db, report.repertoire_id)
+            if not report.issue_count:
+                continue
+            repair_repertoire(self.db, report)
+            self.move_display.invalidate(report.repertoire_id)
+            repaired += report.issue_count
+        if not self.is_training:
+            self.refresh_move_display()
+        self.console_output.append(f"Repaired {repaired} move(s).")
+
+    # --- BACKGROUND MAINTENANCE ---
+    def note_activity(self):
+        self.last_activity = time.monotonic()
+
+    def start_maintenance(self):
+        if not self.maintenance.running:
+            self.maintenance.start()
+            self.maintenance_timer.start()
+
+    def run_maintenance_slice(self):
+        # Wait for the user to be idle, and stay off the database while an expansion writes to it
+        if self.expander or time.monotonic() - self.last_activity < self.MAINTENANCE_IDLE_SECONDS:
+            return
+        if self.maintenance.run_slice(budget_ms=5):
+            return
+        self.maintenance_timer.stop()
+        for problem in self.maintenance.problems:
+            self.console_output.append(f"Database check: {problem}")
+        if self.maintenance.skipped_checks:
+            self.start_table_checks(self.maintenance.skipped_checks)
+        if not self.maintenance.vacuum_enabled:
+            self.offer_vacuum_conversion()
+
+    def start_table_checks(self, tables):
+        """Tables too large for idle slices are checked on a worker thread with its own connection."""
+        if self.check_thread:
+            return
+        self.console_output.append(f"Database check: checking {', '.join(tables)} in the background...")
+        self.check_problems = None
+        self.check_thread = threading.Thread(target=self.run_table_checks, args=(list(tables),), daemon=True)
+        self.check_thread.start()
+        self.check_timer.start()
+
+    def run_table_checks(self, tables):
+        try:
+            self.check_problems = check_tables(self.db.db_path, tables)
+        except Exception as e:
+            self.check_problems = e
+
+    def poll_table_checks(self):
+        if self.check_thread.is_alive():
+            return
+        self.check_timer.stop()
+        self.check_thread = None
+        if isinstance(self.check_problems, Exception):
+            self.console_output.append(f"Database check failed: {self.check_problems}")
+            return
+        for problem in self.check_problems:
+            self.console_output.append(f"Database check: {problem}")
+        if not self.check_problems:
+            self.console_output.append("Database check: no problems found.")
+
+    def offer_vacuum_conversion(self):
+        """Older databases lack incremental auto-vacuum, so idle maintenance cannot shrink them."""
+        if self.vacuum_offered:
+            return
+        self.vacuum_offered = True
+        self.console_output.append("Incremental vacuum is off for this database; idle maintenance cannot shrink the file.")
+        if not self.maintenance.free_pages:
+            return
+        reply = QMessageBox.question(self, "Database Maintenance",
+                                     f"{self.maintenance.free_pages} page(s) of the database file are unused, "
+                                     "but this database cannot release them during idle maintenance.\n\n"
+                                     "Convert it now? The file is rewritten once, which may take a moment.",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        try:
+            self.db.enable_incremental_vacuum()
+        except Exception as e:
+            self.console_output.append(f"Conversion failed: {e}")
+            return
+        self.console_output.append("Database converted; unused space is now released during idle maintenance.")
+
+    # --- CHANGES FROM OTHER CONNECTIONS ---
+    def poll_database_changes(self):
+        """
+        Reloads only the repertoires another connection changed. A writer that commits in
+        batches (an import, another window's expansion) would otherwise trigger a full
+        tree rebuild on every commit, so the reload waits until the changes settle.
+        """
+        now = time.monotonic()
+        version = self.db.data_version()
+        if version != self.db_version:
+            self.db_version = version
+            changed, self.last_change_id = self.db.get_changed_repertoires(self.last_change_id)
+            if self.expander:
+                # poll_expansion reloads this repertoire once our own expansion is done
+                changed.discard(self.expander.repertoire_id)
+            if changed:
+                if not self.pending_changes:
+                    self.first_pending_change = now
+                self.pending_changes |= changed
+                self.last_pending_change = now
+
+        if not self.pending_changes:
+            return
+        if (now - self.last_pending_change < self.CHANGE_SETTLE_SECONDS
+                and now - self.first_pending_change < self.CHANGE_MAX_DELAY_SECONDS):
+            return
+        changed = self.pending_changes
+        self.pending_changes = set()
+
+        for rep_id in changed:
+            self.move_display.invalidate(rep_id)
+        self.sync_repertoire_list()
+        self.lookup_fen = None
+        if self.is_training:
+            # The running session keeps its tree; the next round loads the new one
+            return
+        self.update_position_lookup()
+        if self.current_repertoire_id in changed:
+            self.move_display.update_display(self.current_repertoire_id)
+
+    def sync_repertoire_list(self):
+        """Updates the repertoire list in place, keeping the current selection and board."""
+        repos = self.db.get_repertoires()
+        entries = [(f"{r['name']} ({r['color']})", r['id']) for r in repos]
+        shown = [(self.combo_repertoire.itemText(i), self.combo_repertoire.itemData(i))
+                 for i in range(self.combo_repertoire.count())]
+        if entries == shown or (not repos and not self.current_repertoire_id):
+            return
+        selected = self.combo_repertoire.currentData()
+        if self.snapshot is None and self.current_repertoire_id not in [rep_id for _, rep_id in entries]:
+            # The open repertoire was deleted elsewhere
+            if self.is_training:
+                self.btn_train.setChecked(False)
+                self.toggle_training()
+            self.refresh_repertoires()
+            return
+        self.combo_repertoire.blockSignals(True)
+        self.combo_repertoire.clear()
+        for text, rep_id in entries:
+            self.combo_repertoire.addItem(text, rep_id)
+        self.combo_repertoire.setCurrentIndex(max(0, self.combo_repertoire.findData(selected)))
+        self.combo_repertoire.blockSignals(False)
 
     # --- SMART NAVIGATION LOGIC ---
     def go_back(self):
@@ -196,24 +720,17 @@ class ChessWindow(QWidget):
             self.board_widget.update_board()
             self.status_label.setText(f"Forward: {san}")
 
-        elif self.current_repertoire_id:
-            # Smart Forward (Database)
-            current_fen = self.board.fen()
-            moves = self.db.get_moves_from_fen(self.current_repertoire_id, current_fen)
+        elif self.current_tree() is not None:
+            # Smart Forward (Repertoire tree in memory)
+            tree = self.current_tree()
+            node = tree.node_for_board(self.board)
 
-            if moves:
+            if node is not None and tree.edges(node):
                 # Play the first move found (Main Line)
-                try:
-                    move = chess.Move.from_uci(moves[0]['uci'])
-
-                    # FIX: Calculate SAN *before* pushing the move here too
-                    san = self.board.san(move)
-
-                    self.board.push(move)
-                    self.board_widget.update_board()
-                    self.status_label.setText(f"Forward (Repo): {san}")
-                except:
-                    pass
+                edge = tree.edges(node)[0]
+                self.board.push(tree.edge_move(edge))
+                self.board_widget.update_board()
+                self.status_label.setText(f"Forward (Repo): {tree.san(edge)}")
 
     def go_start(self):
         self.board.reset()
@@ -250,6 +767,142 @@ class ChessWindow(QWidget):
                 if index >= 0:
                     self.combo_repertoire.setCurrentIndex(index)
 
+    def merge_repertoire_dialog(self):
+        if not self.current_repertoire_id: return
+        others = [r for r in self.db.get_repertoires() if r['id'] != self.current_repertoire_id]
+        if not others:
+            return
+        labels = [f"{r['name']} ({r['color']})" for r in others]
+        label, ok = QInputDialog.getItem(self, "Merge Repertoire",
+                                         f"Copy all moves into '{self.combo_repertoire.currentText()}' from:",
+                                         labels, 0, False)
+        if not ok:
+            return
+        source = others[labels.index(label)]
+        diff = self.db.diff_repertoires(source['id'], self.current_repertoire_id)
+        reply = QMessageBox.question(self, "Confirm Merge",
+                                     f"{len(diff['only_in_a'])} new move(s), "
+                                     f"{len(diff['conflicts'])} conflicting comment(s).\n"
+                                     "Replace conflicting comments with the ones from the source?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No |
+                                     QMessageBox.StandardButton.Cancel,
+                                     QMessageBox.StandardButton.No)
+        if reply == QMessageBox.StandardButton.Cancel:
+            return
+        added, updated = self.db.merge_repertoires(source['id'], self.current_repertoire_id,
+                                                   overwrite_comments=reply == QMessageBox.StandardButton.Yes)
+        self.move_display.invalidate(self.current_repertoire_id)
+        self.move_display.update_display(self.current_repertoire_id)
+        self.lookup_fen = None
+        self.update_position_lookup()
+        self.console_output.append(f"Merged {source['name']}: {added} moves, {updated} comments")
+
+    # --- ENGINE EXPANSION ---
+    def toggle_expansion(self):
+        if self.expander:
+            self.expander.stop()
+            self.btn_expand.setEnabled(False)
+            self.console_output.append("Stopping expansion (remaining positions stay queued)...")
+            return
+        if not self.current_repertoire_id: return
+        dlg = ExpandDialog(self)
+        if not dlg.exec():
+            return
+        self.expander = RepertoireExpander(self.db.db_path, self.engine_handler.engine_path,
+                                           self.current_repertoire_id, dlg.get_settings())
+        self.expander_thread = threading.Thread(target=self.expander.run, daemon=True)
+        self.expander_thread.start()
+        self.btn_expand.setText("Stop Expansion")
+        self.console_output.append("Expanding opponent replies in the background...")
+        self.expansion_timer.start()
+
+    def poll_expansion(self):
+        expander = self.expander
+        self.status_label.setText(f"Expansion: {expander.done}/{expander.total} positions, {expander.added} moves added")
+        if self.expander_thread.is_alive():
+            return
+
+        self.expansion_timer.stop()
+        self.expander = None
+        self.expander_thread = None
+        self.btn_expand.setText("Expand Opponent Replies")
+        self.btn_expand.setEnabled(True)
+        if expander.error:
+            self.console_output.append(f"Expansion error: {expander.error}")
+        self.console_output.append(f"Expansion finished: {expander.added} moves added")
+        self.move_display.invalidate(expander.repertoire_id)
+        if expander.repertoire_id == self.current_repertoire_id and not self.is_training:
+            self.move_display.update_display(self.current_repertoire_id)
+
+    def export_snapshot_dialog(self):
+        if not self.current_repertoire_id: return
+        path, _ = QFileDialog.getSaveFileName(self, "Export Snapshot", self.db.data_folder,
+                                              "ChessForge Snapshot (*.cfr)")
+        if path:
+            tree = export_snapshot(self.db, self.current_repertoire_id, path)
+            self.console_output.append(f"Snapshot saved ({len(tree)} moves)")
+
+    def toggle_snapshot(self):
+        if self.snapshot is not None:
+            self.close_snapshot()
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Open Snapshot", self.db.data_folder,
+                                              "ChessForge Snapshot (*.cfr)")
+        if not path:
+            return
+        try:
+            tree = SnapshotTree(path)
+        except (SnapshotError, OSError) as e:
+            QMessageBox.warning(self, "Open Snapshot", str(e))
+            return
+        if self.is_training:
+            self.btn_train.setChecked(False)
+            self.toggle_training()
+
+        # The snapshot replaces the repertoire until it is closed; nothing is written to the database
+        self.snapshot = tree
+        self.current_repertoire_id = None
+        self.combo_repertoire.setEnabled(False)
+        self.btn_open_snapshot.setText("Close Snapshot")
+        self.board.reset()
+        self.redo_stack.clear()
+        self.board_widget.set_orientation(tree.color == "Black")
+        self.move_display.flipped = self.board_widget.is_flipped
+        self.board_widget.update_board()
+        self.move_display.show_tree(tree)
+        self.status_label.setText(f"Snapshot: {tree.name} (read-only)")
+        self.console_output.append(f"Opened snapshot {os.path.basename(path)} ({len(tree)} moves)")
+
+    def close_snapshot(self):
+        if self.snapshot is None:
+            return
+        if self.is_training:
+            self.btn_train.setChecked(False)
+            self.toggle_training()
+        tree = self.snapshot
+        self.snapshot = None
+        self.combo_repertoire.setEnabled(True)
+        self.btn_open_snapshot.setText("Open Snapshot (Read-Only)")
+        # Re-render from the database before the mapping (and the displayed links) go away
+        self.on_repertoire_changed()
+        tree.close()
+
+    def import_snapshot_dialog(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import Snapshot", self.db.data_folder,
+                                              "ChessForge Snapshot (*.cfr)")
+        if not path:
+            return
+        try:
+            repertoire_id = import_snapshot(self.db, path)
+        except (SnapshotError, OSError) as e:
+            QMessageBox.warning(self, "Import Snapshot", str(e))
+            return
+        self.refresh_repertoires()
+        index = self.combo_repertoire.findData(repertoire_id)
+        if index >= 0:
+            self.combo_repertoire.setCurrentIndex(index)
+        self.console_output.append(f"Imported: {self.combo_repertoire.currentText()}")
+
     def reset_board(self):
         self.board.reset()
         self.redo_stack.clear()
@@ -263,7 +916,9 @@ class ChessWindow(QWidget):
                                      QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
             self.db.delete_move(move_id)
+            self.move_display.invalidate(self.current_repertoire_id)
             self.move_display.update_display(self.current_repertoire_id)
+            self.lookup_fen = None
             self.reset_board()
             self.status_label.setText("Move deleted.")
 
@@ -276,12 +931,13 @@ class ChessWindow(QWidget):
                                      QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
             self.db.delete_repertoire(self.current_repertoire_id)
+            self.move_display.invalidate(self.current_repertoire_id)
             self.refresh_repertoires()
             self.console_output.append(f"Deleted: {name}")
 
     def toggle_training(self):
         if self.btn_train.isChecked():
-            if not self.current_repertoire_id:
+            if self.current_tree() is None:
                 self.btn_train.setChecked(False)
                 return
             self.is_training = True
@@ -296,15 +952,19 @@ class ChessWindow(QWidget):
             self.btn_train.setText("Start Training")
             self.btn_train.setStyleSheet("background-color: #009c25; font-weight: bold;")
             self.status_label.setText("Edit Mode")
-            self.move_display.update_display(self.current_repertoire_id)
+            self.refresh_move_display()
 
     def start_new_training_round(self):
         self.board.reset()
         self.board_widget.update_board()
         self.move_display.clear()
-        rep_text = self.combo_repertoire.currentText()
-        color = "White" if "(White)" in rep_text else "Black"
-        computer_move = self.trainer.start_session(self.current_repertoire_id, color)
+        if self.snapshot is not None:
+            color = self.snapshot.color
+        else:
+            rep_text = self.combo_repertoire.currentText()
+            color = "White" if "(White)" in rep_text else "Black"
+        tree = self.current_tree()
+        computer_move = self.trainer.start_session(self.current_repertoire_id, color, tree)
         if computer_move:
             san = self.board.san(computer_move)
             self.board.push(computer_move)
@@ -335,8 +995,9 @@ class ChessWindow(QWidget):
             self.status_label.setText(f"Played: {san_move}")
             comment = self.comment_box.toPlainText()
             self.save_move_to_db(from_fen, self.board.fen(), move.uci(), comment)
-            self.move_display.update_display(self.current_repertoire_id)
-            self.comment_box.clear()
+            if self.snapshot is None:
+                self.move_display.update_display(self.current_repertoire_id)
+                self.comment_box.clear()
 
     def computer_reply_turn(self):
         if not self.is_training: return
@@ -362,9 +1023,26 @@ class ChessWindow(QWidget):
     def save_move_to_db(self, from_fen, to_fen, uci_move, comment):
         if self.current_repertoire_id:
             self.db.add_move(self.current_repertoire_id, from_fen, to_fen, uci_move, comment)
+            self.move_display.invalidate(self.current_repertoire_id)
+            self.lookup_fen = None
+            self.update_position_lookup()
         else:
             self.console_output.append("Moved (Not Saved)")
 
+    def current_tree(self):
+        """Tree shown in the window: the open snapshot, else the current repertoire's cached tree."""
+        if self.snapshot is not None:
+            return self.snapshot
+        if self.current_repertoire_id:
+            return self.move_display.get_tree(self.current_repertoire_id)
+        return None
+
+    def refresh_move_display(self):
+        if self.snapshot is not None:
+            self.move_display.show_tree(self.snapshot)
+        else:
+            self.move_display.update_display(self.current_repertoire_id)
+
     def refresh_repertoires(self):
         self.combo_repertoire.blockSignals(True)
         self.combo_repertoire.clear()
@@ -380,6 +1058,10 @@ class ChessWindow(QWidget):
         self.on_repertoire_changed()
 
     def on_repertoire_changed(self):
+        if self.snapshot is not None:
+            # Switching repertoire (or reloading the list) leaves the snapshot
+            self.close_snapshot()
+            return
         self.current_repertoire_id = self.combo_repertoire.currentData()
         self.board.reset()
         self.redo_stack.clear()
@@ -388,18 +1070,60 @@ class ChessWindow(QWidget):
             self.board_widget.set_orientation(color == "Black")
         else:
             self.board_widget.set_orientation(False)
+        self.move_display.flipped = self.board_widget.is_flipped
         self.board_widget.update_board()
         self.status_label.setText("Start Position")
         self.move_display.update_display(self.current_repertoire_id)
 
     def ask_engine(self):
+        if self.engine_thread:
+            return
         self.console_output.append("Thinking...")
-        from PyQt6.QtWidgets import QApplication
-        QApplication.processEvents()
+        self.btn_analyze.setEnabled(False)
         fen = self.board.fen()
-        info = self.engine_handler.get_evaluation(fen)
+        self.engine_result = None
+        self.engine_thread = threading.Thread(target=self.run_engine_search, args=(fen,), daemon=True)
+        self.engine_thread.start()
+        self.engine_timer.start()
+
+    def run_engine_search(self, fen):
+        # Worker thread: no widgets here, poll_engine_search shows the result
+        try:
+            info = self.engine_handler.get_evaluation(fen, adaptive=True)
+            # Telemetry is taken together with the result, on this thread
+            self.engine_result = (fen, info, self.engine_handler.last_search, None)
+        except Exception as e:
+            self.engine_result = (fen, None, None, e)
+
+    def poll_engine_search(self):
+        if self.engine_thread.is_alive():
+            return
+        self.engine_timer.stop()
+        self.engine_thread = None
+        self.btn_analyze.setEnabled(True)
+        fen, info, search, error = self.engine_result
+        if error:
+            self.console_output.append(f"Engine error: {error}")
+            return
         if info:
-            score = info["score"].white()
-            best_move = info.get("pv")[0] if "pv" in info else None
-            self.console_output.append(f"Score: {score}")
-            self.console_output.append(f"Best: {best_move}")
\ No newline at end of file
+            # With MultiPV the engine returns one info per line, best first
+            lines = info if isinstance(info, list) else [info]
+            # The deeper result replaces the quick prefetched one
+            self.prefetcher.store_evaluation(fen, lines[0])
+            board = chess.Board(fen)
+            for number, line in enumerate(lines, 1):
+                if "score" not in line or not line.get("pv"):
+                    continue
+                prefix = f"{number}. " if len(lines) > 1 else ""
+                self.console_output.append(f"{prefix}Score: {line['score'].white()}")
+                self.console_output.append(f"{prefix}Best: {board.variation_san(line['pv'][:6])}")
+            if search:
+                self.console_output.append(
+                    f"(depth {search['depth']}, {search['time']:.2f}s, stopped: {search['stopped_by']})")
+
+    def engine_settings_dialog(self):
+        dlg = EngineSettingsDialog(self)
+        if dlg.exec():
+            # Applied to the running engine right away (waits for a search in progress)
+            self.engine_handler.configure(**dlg.save())
+            self.console_output.append("Engine settings saved.")
@@ -1,10 +1,11 @@
 import sys
 import os
+import multiprocessing
 import traceback
 import logging
 from PyQt6.QtWidgets import QApplication, QMessageBox
-from gui import ChessWindow
-from engine_handler import EngineHandler
+from gui import ChessWindow, load_engine_settings
+from engine_handler import EngineHandler, default_engine_path
 # CRITICAL: We import from your new file
 from database import ChessDatabase
 
@@ -17,23 +18,13 @@ logging.basicConfig(
 )
 
 
-def get_resource_path(relative_path):
-    """ Get absolute path to resource, works for dev and for PyInstaller """
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.dirname(os.path.abspath(__file__))
-    return os.path.join(base_path, relative_path)
-
-
 def main():
     logging.info("Starting ChessForge")
     app = QApplication(sys.argv)
 
     try:
         # 1. Engine
-        engine_path = get_resource_path(os.path.join("engines", "stockfish"))
+        engine_path = default_engine_path()
         logging.info(f"Engine path: {engine_path}")
 
         # Ensure executable permissions on macOS/Linux
@@ -41,7 +32,8 @@ def main():
             logging.info("Setting executable permissions on engine")
             os.chmod(engine_path, 0o755)
 
-        engine = EngineHandler(engine_path)
+        # Threads/Hash/MultiPV are user settings (Engine Settings... in the window)
+        engine = EngineHandler(engine_path, **load_engine_settings())
         try:
             engine.start_engine()
             logging.info("Engine started successfully")
@@ -91,4 +83,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Needed for worker processes (validation) in the PyInstaller build
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Background database maintenance.
+
+A maintenance cycle removes positions no move refers to any more, refreshes
+the query planner statistics, gives free pages back to the file system and
+checks integrity. It is split into small steps so the GUI can run it from a
+timer in slices of a few milliseconds while the user is idle.
+
+Move references are checked in chunks like the orphan cleanup. The per-table
+quick_check / foreign_key_check cannot be split and grows with the table
+(about 13 ms for 22k moves), so it would blow the slice budget on large
+tables; those are skipped unless full_check is set (the CLI does). The GUI
+runs the skipped ones with check_tables() on a background thread instead.
+
+Databases created before incremental auto-vacuum was enabled cannot give
+pages back in slices; vacuum_enabled tells the caller so it can offer the
+one-time conversion (ChessDatabase.enable_incremental_vacuum).
+"""
+import os
+import time
+
+from database import ChessDatabase
+
+# Tables checked one at a time, so no single step scans the whole file
+CHECKED_TABLES = ("repertoires", "positions", "moves", "expansion_jobs")
+# Tables larger than this only get the whole-table check with full_check
+QUICK_CHECK_ROWS = 5000
+
+
+class DatabaseMaintenance:
+    def __init__(self, database, gc_chunk=500, vacuum_pages=64, full_check=False):
+        self.db = database
+        self.gc_chunk = gc_chunk
+        self.vacuum_pages = vacuum_pages
+        self.full_check = full_check
+        self._steps = None
+        self.reset_results()
+
+    def reset_results(self):
+        self.orphans_deleted = 0
+        self.free_pages = 0
+        self.problems = []
+        self.skipped_checks = []  # tables too large for a whole-table check in one slice
+        self.vacuum_enabled = True
+
+    @property
+    def running(self):
+        return self._steps is not None
+
+    def start(self):
+        self.reset_results()
+        self._steps = self.steps()
+
+    def steps(self):
+        """Generator: every iteration does one short unit of work."""
+        after_id = 0
+        while after_id is not None:
+            deleted, after_id = self.db.delete_orphan_positions(after_id, self.gc_chunk)
+            self.orphans_deleted += deleted
+            yield
+
+        self.db.optimize()
+        yield
+
+        self.vacuum_enabled = self.db.incremental_vacuum_enabled()
+        while self.vacuum_enabled:
+            free_pages = self.db.incremental_vacuum(self.vacuum_pages)
+            self.free_pages = free_pages
+            yield
+            if free_pages == 0:
+                break
+        if not self.vacuum_enabled:
+            self.free_pages = self.db.free_pages()
+
+        after_id = 0
+        while after_id is not None:
+            problems, after_id = self.db.check_move_references(after_id, self.gc_chunk)
+            self.problems += problems
+            yield
+
+        for table in CHECKED_TABLES:
+            if not self.full_check and self.db.table_size(table) > QUICK_CHECK_ROWS:
+                self.skipped_checks.append(table)
+                continue
+            # Move references were already checked in chunks above
+            self.problems += self.db.check_integrity(table, foreign_keys=table != "moves")
+            yield
+
+    def run_slice(self, budget_ms=5):
+        """Runs steps until the time budget is used. Returns False once the cycle is complete."""
+        if self._steps is None:
+            return False
+        deadline = time.monotonic() + budget_ms / 1000.0
+        while time.monotonic() < deadline:
+            try:
+                next(self._steps)
+            except StopIteration:
+                self._steps = None
+                return False
+        return True
+
+    def run_all(self):
+        self.start()
+        while self.run_slice(budget_ms=1000):
+            pass
+
+
+def check_tables(db_path, tables):
+    """Whole-table integrity checks on a connection of their own, for a background thread."""
+    folder, filename = os.path.split(db_path)
+    database = ChessDatabase(filename, data_folder=folder, verbose=False)
+    try:
+        problems = []
+        for table in tables:
+            # Move references are covered by the chunked check in steps()
+            problems += database.check_integrity(table, foreign_keys=table != "moves")
+        return problems
+    finally:
+        database.close()
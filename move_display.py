@@ -1,7 +1,10 @@
-from PyQt6.QtWidgets import QTextBrowser, QMenu
-from PyQt6.QtCore import pyqtSignal, Qt, QUrl
-from PyQt6.QtGui import QAction
+from PyQt6.QtWidgets import QTextBrowser, QMenu, QLabel
+from PyQt6.QtCore import pyqtSignal, Qt, QUrl, QPoint, QTimer
+from PyQt6.QtGui import QAction, QPixmap
+import os
 import chess
+from repertoire_tree import RepertoireTree
+from thumbnails import ThumbnailCache
 
 
 class MoveDisplay(QTextBrowser):
@@ -13,9 +16,30 @@ class MoveDisplay(QTextBrowser):
     def __init__(self, database):
         super().__init__()
         self.db = database
+        # repertoire_id -> RepertoireTree, rebuilt only after invalidate()
+        self.trees = {}
+        # Tree currently shown; links are 'edge:N' into it
+        self.tree = None
+        self.incoming = {}  # node -> edge it was first reached by while rendering
         self.setOpenLinks(False)
         self.anchorClicked.connect(self.on_anchor_clicked)
 
+        # --- Hover previews ---
+        self.flipped = False
+        self.hover_key = None
+        self.thumbnails = ThumbnailCache(cache_dir=os.path.join(database.data_folder, "thumbnails"))
+        self.thumbnails.thumbnail_ready.connect(self.on_thumbnail_ready)
+        self.preview = QLabel(self, Qt.WindowType.ToolTip)
+        self.preview.hide()
+        self.viewport().setMouseTracking(True)
+
+        # Prefetch previews of the links on screen once scrolling settles
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(150)
+        self.prefetch_timer.timeout.connect(self.prefetch_visible_thumbnails)
+        self.verticalScrollBar().valueChanged.connect(self.prefetch_timer.start)
+
         self.setStyleSheet("""
             QTextBrowser {
                 font-size: 14px;
@@ -29,9 +53,9 @@ class MoveDisplay(QTextBrowser):
         pos = event.pos()
         anchor = self.anchorAt(pos)  # Get the URL under mouse
 
-        # Check if the user right-clicked on a move link
-        if anchor and anchor.startswith("move:"):
-            move_id = int(anchor.split(":")[1])
+        # Check if the user right-clicked on a move link (snapshots are read-only)
+        if anchor and anchor.startswith("edge:") and self.tree.repertoire_id is not None:
+            move_id = self.tree.move_id(int(anchor.split(":")[1]))
 
             menu = QMenu(self)
             delete_action = QAction("Delete this Move (and variations)", self)
@@ -40,11 +64,93 @@ class MoveDisplay(QTextBrowser):
 
             menu.exec(event.globalPos())
 
+    # --- HOVER PREVIEW ---
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        anchor = self.anchorAt(event.pos())
+        if not anchor or not anchor.startswith("edge:"):
+            self.hide_preview()
+            return
+
+        edge = int(anchor.split(":")[1])
+        key = self.thumbnail_key(edge)
+        self.preview_pos = event.globalPosition().toPoint() + QPoint(16, 16)
+        if key == self.hover_key and self.preview.isVisible():
+            self.preview.move(self.preview_pos)
+            return
+        self.hover_key = key
+        image = self.thumbnails.get(key)
+        if image is None:
+            # Shown by on_thumbnail_ready when the render finishes
+            self.preview.hide()
+            self.thumbnails.request(key, self.board_after(edge).fen())
+        else:
+            self.show_preview(image)
+
+    def leaveEvent(self, event):
+        self.hide_preview()
+        super().leaveEvent(event)
+
+    def show_preview(self, image):
+        self.preview.setPixmap(QPixmap.fromImage(image))
+        self.preview.adjustSize()
+        self.preview.move(self.preview_pos)
+        self.preview.show()
+
+    def hide_preview(self):
+        self.hover_key = None
+        self.preview.hide()
+
+    def on_thumbnail_ready(self, key):
+        if key == self.hover_key:
+            self.show_preview(self.thumbnails.get(key))
+
+    def thumbnail_key(self, edge):
+        # The tree already holds the hash of every position
+        return self.tree.hashes[self.tree.target(edge)], self.flipped
+
+    def board_after(self, edge):
+        """Replays the moves leading to an edge's target, following the rendered lines back to the root."""
+        path = []
+        while edge is not None:
+            path.append(edge)
+            edge = self.incoming.get(self.tree.parent(edge))
+        board = chess.Board()
+        for edge in reversed(path):
+            board.push(self.tree.edge_move(edge))
+        return board
+
+    def visible_edges(self, limit=60):
+        """Edges of the links currently on screen."""
+        document = self.document()
+        first = self.cursorForPosition(QPoint(0, 0)).position()
+        last = self.cursorForPosition(QPoint(self.viewport().width(), self.viewport().height())).position()
+        block = document.findBlock(first)
+        ids = []
+        while block.isValid() and block.position() <= last and len(ids) < limit:
+            it = block.begin()
+            while not it.atEnd():
+                href = it.fragment().charFormat().anchorHref()
+                if href.startswith("edge:"):
+                    ids.append(int(href.split(":")[1]))
+                it += 1
+            block = block.next()
+        return ids[:limit]
+
+    def prefetch_visible_thumbnails(self):
+        for edge in self.visible_edges():
+            key = self.thumbnail_key(edge)
+            if self.thumbnails.get(key) is None:
+                self.thumbnails.request(key, self.board_after(edge).fen())
+
     def on_anchor_clicked(self, url):
         """Handle Left-Click to Jump."""
         link = url.toString()
-        # Newer links use "move:123" format
-        if link.startswith("move:"):
+        # Links point at an edge of the displayed tree
+        if link.startswith("edge:"):
+            self.move_clicked.emit(self.board_after(int(link.split(":")[1])).fen())
+        # Links rendered from the database used "move:123"
+        elif link.startswith("move:"):
             move_id = int(link.split(":")[1])
             fen = self.db.get_move_by_id(move_id)
             if fen:
@@ -53,13 +159,36 @@ class MoveDisplay(QTextBrowser):
         else:
             self.move_clicked.emit(link)
 
+    def get_tree(self, repertoire_id):
+        """Cached in-memory tree of a repertoire (one query the first time)."""
+        tree = self.trees.get(repertoire_id)
+        if tree is None:
+            tree = RepertoireTree.from_database(self.db, repertoire_id)
+            self.trees[repertoire_id] = tree
+        return tree
+
+    def invalidate(self, repertoire_id=None):
+        """Drops the cached tree of a repertoire (or all of them) after it changed."""
+        if repertoire_id is None:
+            self.trees.clear()
+        else:
+            self.trees.pop(repertoire_id, None)
+
     def update_display(self, repertoire_id):
         if not repertoire_id:
+            self.hide_preview()
             self.clear()
             return
+        self.show_tree(self.get_tree(repertoire_id))
 
-        board = chess.Board()
-        html = self._generate_html_recursive(repertoire_id, board, set())
+    def show_tree(self, tree):
+        """Renders any RepertoireTree, including a memory-mapped SnapshotTree."""
+        self.hide_preview()
+        self.tree = tree
+        self.incoming = {}
+        html = ""
+        if tree.root is not None:
+            html = self._generate_html_recursive(tree, tree.root, 0, set())
 
         full_html = f"""
         <html>
@@ -76,42 +205,36 @@ class MoveDisplay(QTextBrowser):
         </html>
         """
         self.setHtml(full_html)
+        self.prefetch_timer.start()
 
-    def _generate_html_recursive(self, repertoire_id, board, visited_fens):
-        current_fen = board.fen()
-        fen_simple = " ".join(current_fen.split(" ")[:4])
-
-        if fen_simple in visited_fens:
+    def _generate_html_recursive(self, tree, node, ply, visited_nodes):
+        if node in visited_nodes:
             return " <span style='color:red'>(Loop)</span>"
-        visited_fens.add(fen_simple)
-
-        # Ensure database.py is updated to return 'id' in this call!
-        moves_data = self.db.get_moves_from_fen(repertoire_id, current_fen)
+        visited_nodes.add(node)
 
-        if not moves_data:
-            visited_fens.remove(fen_simple)
+        edges = tree.edges(node)
+        if not edges:
+            visited_nodes.remove(node)
             return ""
 
         html_out = ""
-        is_branching = len(moves_data) > 1
+        is_branching = len(edges) > 1
 
         if is_branching:
             html_out += "<ul>"
 
-        for row in moves_data:
-            # We need the ID for the delete logic
-            move_id = row['id']
-            uci = row['uci']
-            comment = row['comment']
+        # Positions in the tree are reached from the start position, so the ply gives the move number
+        move_num = ply // 2 + 1
+        white_to_move = ply % 2 == 0
 
-            try:
-                move = chess.Move.from_uci(uci)
-                san = board.san(move)
-            except ValueError:
-                continue
+        for edge in edges:
+            target = tree.target(edge)
+            if target != tree.root:
+                self.incoming.setdefault(target, edge)
+            san = tree.san(edge)
+            comment = tree.comment(edge)
 
-            move_num = board.fullmove_number
-            if board.turn == chess.WHITE:
+            if white_to_move:
                 move_text = f"{move_num}. {san}"
             else:
                 if is_branching or not html_out.strip():
@@ -119,14 +242,12 @@ class MoveDisplay(QTextBrowser):
                 else:
                     move_text = san
 
-            # --- KEY CHANGE: Link is now 'move:ID', not 'FEN' ---
-            link = f"<a href='move:{move_id}' title='{comment if comment else ''}'>{move_text}</a>"
+            # Link is the edge index; the move id (for delete) and position come from the tree
+            link = f"<a href='edge:{edge}' title='{comment if comment else ''}'>{move_text}</a>"
 
             comment_span = f" <span class='comment'>{{{comment}}}</span>" if comment else ""
 
-            board.push(move)
-            children_html = self._generate_html_recursive(repertoire_id, board, visited_fens)
-            board.pop()
+            children_html = self._generate_html_recursive(tree, target, ply + 1, visited_nodes)
 
             if is_branching:
                 html_out += f"<li>{link}{comment_span}{children_html}</li>"
@@ -136,5 +257,5 @@ class MoveDisplay(QTextBrowser):
         if is_branching:
             html_out += "</ul>"
 
-        visited_fens.remove(fen_simple)
-        return html_out
\ No newline at end of file
+        visited_nodes.remove(node)
+        return html_out
@@ -0,0 +1,103 @@
+"""
+Speculative prefetch of the positions likely to be visited next.
+
+After every navigation the window hands the prefetcher the current board and
+repertoire tree. The prefetcher walks a few plies ahead in the (in-memory)
+tree and queues engine evaluations for those positions on a background
+thread, nearest plies first. Work queued for an earlier position is dropped
+as soon as the user moves on, so the engine is always busy with the
+positions that are actually one click away.
+"""
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+
+
+def _position_key(fen):
+    return " ".join(fen.split(" ")[:4])
+
+
+class PositionPrefetcher:
+    def __init__(self, engine_handler, plies=2, time_limit=0.1, cache_size=5000):
+        self.engine_handler = engine_handler
+        self.plies = plies
+        self.time_limit = time_limit
+        self.cache_size = cache_size
+
+        self.evaluations = OrderedDict()  # position key -> engine info, least recently used first
+        self.cache_lock = threading.Lock()
+        self.jobs = queue.PriorityQueue()
+        self.generation = 0
+        self.counter = itertools.count()
+        self.thread = None
+
+    # --- Cache ---
+    def get_evaluation(self, fen):
+        key = _position_key(fen)
+        with self.cache_lock:
+            info = self.evaluations.get(key)
+            if info is not None:
+                self.evaluations.move_to_end(key)
+            return info
+
+    def store_evaluation(self, fen, info):
+        with self.cache_lock:
+            self.evaluations[_position_key(fen)] = info
+            self.evaluations.move_to_end(_position_key(fen))
+            while len(self.evaluations) > self.cache_size:
+                self.evaluations.popitem(last=False)
+
+    # --- Scheduling ---
+    def prefetch(self, board, tree=None):
+        """Queues the current position and, if a tree is given, the positions a few plies ahead."""
+        self.generation += 1
+        self._queue(board.fen(), 0)
+
+        if tree is None:
+            return
+        node = tree.node_for_board(board)
+        if node is None:
+            return
+        frontier = [(node, board)]
+        seen = {node}
+        for ply in range(1, self.plies + 1):
+            next_frontier = []
+            for parent, parent_board in frontier:
+                for edge in tree.edges(parent):
+                    target = tree.target(edge)
+                    if target in seen:
+                        continue
+                    seen.add(target)
+                    child_board = parent_board.copy(stack=False)
+                    child_board.push(tree.edge_move(edge))
+                    self._queue(child_board.fen(), ply)
+                    next_frontier.append((target, child_board))
+            frontier = next_frontier
+
+    def cancel(self):
+        """Drops everything still queued."""
+        self.generation += 1
+
+    def _queue(self, fen, ply):
+        if self.get_evaluation(fen) is not None:
+            return
+        # Newest generation first, then nearest ply, then tree order
+        self.jobs.put((-self.generation, ply, next(self.counter), fen))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._worker, daemon=True)
+            self.thread.start()
+
+    def _worker(self):
+        while True:
+            generation, _, _, fen = self.jobs.get()
+            if -generation != self.generation or self.get_evaluation(fen) is not None:
+                # Queued for a position the user already left
+                continue
+            try:
+                # Not recorded: last_search belongs to the searches the user asked for
+                info = self.engine_handler.get_evaluation(fen, time_limit=self.time_limit, record=False, multipv=1)
+            except Exception:
+                continue
+            if info:
+                self.store_evaluation(fen, info)
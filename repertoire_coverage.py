@@ -0,0 +1,153 @@
+"""
+Repertoire coverage against played games.
+
+Streams a PGN file, walks every game against a RepertoireTree and records
+where it left the repertoire. Games are parsed in worker processes; each
+worker gets a copy of the (compact) tree once via the pool initializer and
+stops parsing moves as soon as the game is out of book.
+"""
+import io
+import os
+from collections import Counter
+from multiprocessing import Pool
+
+import chess
+import chess.pgn
+
+from repertoire_tree import position_hash
+
+# Per-process state, set by _init_worker
+_tree = None
+_color = None
+_player = None
+
+
+class _CoverageVisitor(chess.pgn.BaseVisitor):
+    """Replays the mainline only as far as the repertoire knows it."""
+
+    def begin_game(self):
+        self.headers = {}
+        self.ply = 0
+        self.done = False
+        self.outcome = ("empty",)
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def end_headers(self):
+        if _player:
+            if self.headers.get("White") == _player:
+                side = chess.WHITE
+            elif self.headers.get("Black") == _player:
+                side = chess.BLACK
+            else:
+                side = None
+            if side != _color:
+                self.done = True
+                self.outcome = ("skipped",)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def parse_san(self, board, san):
+        # Once out of book the rest of the game is irrelevant: skip the expensive SAN parsing
+        if self.done:
+            return chess.Move.null()
+        return board.parse_san(san)
+
+    def visit_move(self, board, move):
+        if self.done:
+            return
+        node = _tree.node_for_hash(position_hash(board))
+        if node is None:
+            # Only possible for the first move (custom FEN start)
+            self.done = True
+            self.outcome = ("outside",)
+        elif not _tree.edge_count[node]:
+            self.done = True
+            self.outcome = ("end_of_line", self.ply)
+        elif _tree.find_edge(node, move) is None:
+            self.done = True
+            who = "you" if board.turn == _color else "opponent"
+            self.outcome = ("deviation", board.fen(), self.ply, board.san(move), who)
+        self.ply += 1
+
+    def handle_error(self, error):
+        self.done = True
+        self.outcome = ("error",)
+
+    def result(self):
+        if not self.done and self.ply:
+            return ("in_book", self.ply)
+        return self.outcome
+
+
+def _init_worker(tree, color, player):
+    global _tree, _color, _player
+    _tree = tree
+    _color = color
+    _player = player
+
+
+def _analyse_game(text):
+    return chess.pgn.read_game(io.StringIO(text), Visitor=_CoverageVisitor)
+
+
+def iter_game_texts(handle):
+    """Splits a PGN stream into the raw text of each game without parsing it."""
+    lines = []
+    in_moves = False
+    for line in handle:
+        if line.startswith("[") and in_moves:
+            yield "".join(lines)
+            lines = []
+            in_moves = False
+        elif line.strip() and not line.startswith("["):
+            in_moves = True
+        lines.append(line)
+    if in_moves:
+        yield "".join(lines)
+
+
+class CoverageReport:
+    def __init__(self):
+        self.games = 0
+        self.outcomes = Counter()
+        # (fen, ply, san, who) -> number of games
+        self.deviations = Counter()
+        self.line_ends = Counter()
+
+    def add(self, outcome):
+        self.games += 1
+        self.outcomes[outcome[0]] += 1
+        if outcome[0] == "deviation":
+            self.deviations[outcome[1:]] += 1
+        elif outcome[0] == "end_of_line":
+            self.line_ends[outcome[1]] += 1
+
+    def ranked(self, limit=None):
+        """Deviations ordered by frequency: [(count, fen, ply, san, who), ...]"""
+        return [(count,) + key for key, count in self.deviations.most_common(limit)]
+
+
+def analyse_coverage(pgn_path, tree, color_name, player=None, workers=None, chunksize=64):
+    """
+    Walks every game in a PGN file against a repertoire.
+    color_name is the repertoire color ("White"/"Black"); when player is given only
+    games where that player had the repertoire color are counted.
+    """
+    color = chess.WHITE if color_name == "White" else chess.BLACK
+    workers = workers or os.cpu_count() or 1
+    report = CoverageReport()
+
+    with open(pgn_path, encoding="utf-8", errors="replace") as handle:
+        games = iter_game_texts(handle)
+        if workers == 1:
+            _init_worker(tree, color, player)
+            for text in games:
+                report.add(_analyse_game(text))
+        else:
+            with Pool(workers, initializer=_init_worker, initargs=(tree, color, player)) as pool:
+                for outcome in pool.imap_unordered(_analyse_game, games, chunksize):
+                    report.add(outcome)
+    return report
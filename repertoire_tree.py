@@ -0,0 +1,162 @@
+import sys
+from array import array
+
+import chess
+import chess.polyglot
+
+
+def position_hash(board):
+    """Zobrist hash used to identify positions independently of move order."""
+    return chess.polyglot.zobrist_hash(board)
+
+
+def fen_hash(fen):
+    return position_hash(chess.Board(fen))
+
+
+def pack_move(move):
+    """Packs a move into 15 bits: from square, to square, promotion piece type."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def unpack_move(value):
+    return chess.Move(value & 63, (value >> 6) & 63, promotion=(value >> 12) or None)
+
+
+class RepertoireTree:
+    """
+    Compact in-memory copy of one repertoire, loaded with a single query.
+
+    Positions are nodes, moves are edges. Everything lives in parallel arrays:
+    the edges of a node are stored contiguously (first_edge / edge_count), each
+    edge keeps its packed 16-bit move, target and parent node, database id and
+    precomputed SAN. Walking the tree therefore needs no database access, no
+    UCI parsing and no per-move Python objects.
+    """
+
+    def __init__(self, repertoire_id=None):
+        self.repertoire_id = repertoire_id
+        self.root = None
+
+        # Nodes (positions)
+        self.hashes = array('Q')
+        self.first_edge = array('I')
+        self.edge_count = array('H')
+        self._index = {}  # position hash -> node
+
+        # Edges (moves)
+        self.moves = array('H')
+        self.targets = array('I')
+        self.parents = array('I')
+        self.move_ids = array('q')
+        self.sans = []
+        self.comments = {}  # edge -> comment, only for commented moves
+
+    @classmethod
+    def from_database(cls, database, repertoire_id):
+        tree = cls(repertoire_id)
+        rows = database.get_repertoire_moves(repertoire_id)
+
+        # Assign a node to every distinct position, group moves by their start node
+        nodes = {}  # position id -> node
+        fens = []
+        grouped = {}
+        for row in rows:
+            if row['from_fen'] is None or row['to_fen'] is None:
+                # Dangling position reference; validator.py reports and repairs these
+                continue
+            for pos_id, fen in ((row['from_position_id'], row['from_fen']), (row['to_position_id'], row['to_fen'])):
+                if pos_id not in nodes:
+                    key = fen_hash(fen)
+                    if key not in tree._index:
+                        tree._index[key] = len(fens)
+                        tree.hashes.append(key)
+                        fens.append(fen)
+                    nodes[pos_id] = tree._index[key]
+            grouped.setdefault(nodes[row['from_position_id']], []).append(row)
+
+        tree.first_edge = array('I', bytes(4 * len(fens)))
+        tree.edge_count = array('H', bytes(2 * len(fens)))
+
+        for node, children in grouped.items():
+            board = chess.Board(fens[node])
+            tree.first_edge[node] = len(tree.moves)
+            for row in children:
+                try:
+                    move = chess.Move.from_uci(row['uci'])
+                except ValueError:
+                    continue
+                if not board.is_legal(move) or tree.find_edge(node, move) is not None:
+                    # Corrupt or duplicate rows are skipped, like the move display always did
+                    continue
+                san = sys.intern(board.san(move))
+                edge = len(tree.moves)
+                tree.moves.append(pack_move(move))
+                tree.targets.append(nodes[row['to_position_id']])
+                tree.parents.append(node)
+                tree.move_ids.append(row['id'])
+                tree.sans.append(san)
+                if row['comment']:
+                    tree.comments[edge] = row['comment']
+                tree.edge_count[node] += 1
+
+        tree.root = tree._index.get(position_hash(chess.Board()))
+        return tree
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self.moves)
+
+    # --- Nodes ---
+    def node_for_hash(self, key):
+        return self._index.get(key)
+
+    def node_for_board(self, board):
+        return self._index.get(position_hash(board))
+
+    def edges(self, node):
+        start = self.first_edge[node]
+        return range(start, start + self.edge_count[node])
+
+    def find_edge(self, node, move):
+        """Edge index of `move` from `node`, or None if the repertoire does not have it."""
+        packed = pack_move(move)
+        for edge in self.edges(node):
+            if self.moves[edge] == packed:
+                return edge
+        return None
+
+    # --- Edges ---
+    def edge_move(self, edge):
+        return unpack_move(self.moves[edge])
+
+    def edge_uci(self, edge):
+        return self.edge_move(edge).uci()
+
+    def san(self, edge):
+        return self.sans[edge]
+
+    def comment(self, edge):
+        return self.comments.get(edge, "")
+
+    def move_id(self, edge):
+        return self.move_ids[edge]
+
+    def target(self, edge):
+        return self.targets[edge]
+
+    def parent(self, edge):
+        return self.parents[edge]
+
+    # --- Compatibility helpers ---
+    def moves_from_hash(self, key):
+        """UCI moves stored for a position, or an empty list if the position is unknown."""
+        node = self._index.get(key)
+        if node is None:
+            return []
+        return [self.edge_uci(edge) for edge in self.edges(node)]
+
+    def moves_from_board(self, board):
+        return self.moves_from_hash(position_hash(board))
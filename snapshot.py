@@ -0,0 +1,248 @@
+"""
+Binary repertoire snapshots.
+
+A snapshot is a RepertoireTree written to disk as fixed-width little-endian
+columns plus a string table (SAN, comments, repertoire name). The file is
+memory-mapped when opened, and SnapshotTree reads the columns in place, so
+opening a book costs a header read no matter how many moves it holds.
+Several processes opening the same snapshot share its pages.
+
+Layout (version 1), every section aligned to 8 bytes:
+    header      magic, version, counts, root node, section offsets
+    hashes      u64[nodes]  position hashes, sorted (nodes are looked up by bisection)
+    first_edge  u32[nodes]
+    edge_count  u16[nodes]
+    moves       u16[edges]  packed moves (see repertoire_tree.pack_move)
+    targets     u32[edges]
+    parents     u32[edges]
+    move_ids    i64[edges]
+    san_refs    u32[edges]  index into the string table
+    comment_refs u32[edges] index into the string table (0 = no comment)
+    str_offsets u32[strings + 1]
+    str_data    utf-8 bytes
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+import chess
+
+from repertoire_tree import RepertoireTree, position_hash
+
+MAGIC = b"CFRS"
+VERSION = 1
+NO_NODE = 0xFFFFFFFF
+
+# magic, version, color (0 = White, 1 = Black), node count, edge count, string count, root node
+_HEADER = struct.Struct("<4sHHIIII")
+_SECTIONS = ("hashes", "first_edge", "edge_count", "moves", "targets", "parents",
+             "move_ids", "san_refs", "comment_refs", "str_offsets", "str_data")
+_OFFSETS = struct.Struct("<" + "Q" * len(_SECTIONS))
+_TYPECODES = {"hashes": "Q", "first_edge": "I", "edge_count": "H", "moves": "H", "targets": "I",
+              "parents": "I", "move_ids": "q", "san_refs": "I", "comment_refs": "I", "str_offsets": "I"}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_snapshot(tree, path, name="", color="White"):
+    """Writes a RepertoireTree to `path` (atomically, via a temporary file)."""
+    node_count = len(tree.hashes)
+    order = sorted(range(node_count), key=tree.hashes.__getitem__)
+    new_node = array('I', bytes(4 * node_count))
+    for new, old in enumerate(order):
+        new_node[old] = new
+
+    # String 0 is the empty string (no comment), string 1 the repertoire name
+    string_list = ["", name]
+    strings = {"": 0}
+    strings.setdefault(name, 1)
+
+    def string_ref(text):
+        ref = strings.get(text)
+        if ref is None:
+            ref = strings[text] = len(string_list)
+            string_list.append(text)
+        return ref
+
+    columns = {key: array(code) for key, code in _TYPECODES.items()}
+    for old in order:
+        columns["hashes"].append(tree.hashes[old])
+        columns["first_edge"].append(len(columns["moves"]))
+        columns["edge_count"].append(tree.edge_count[old])
+        for edge in tree.edges(old):
+            columns["moves"].append(tree.moves[edge])
+            columns["targets"].append(new_node[tree.targets[edge]])
+            columns["parents"].append(new_node[tree.parents[edge]])
+            columns["move_ids"].append(tree.move_ids[edge])
+            columns["san_refs"].append(string_ref(tree.san(edge)))
+            columns["comment_refs"].append(string_ref(tree.comment(edge)))
+
+    data = bytearray()
+    for text in string_list:
+        columns["str_offsets"].append(len(data))
+        data += text.encode("utf-8")
+    columns["str_offsets"].append(len(data))
+
+    if sys.byteorder != "little":
+        for column in columns.values():
+            column.byteswap()
+
+    blobs = [columns[key].tobytes() for key in _SECTIONS[:-1]] + [bytes(data)]
+    offsets = []
+    position = _align(_HEADER.size + _OFFSETS.size)
+    for blob in blobs:
+        offsets.append(position)
+        position = _align(position + len(blob))
+
+    root = new_node[tree.root] if tree.root is not None else NO_NODE
+    header = _HEADER.pack(MAGIC, VERSION, 0 if color == "White" else 1,
+                          node_count, len(columns["moves"]), len(string_list), root)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(header)
+        handle.write(_OFFSETS.pack(*offsets))
+        for offset, blob in zip(offsets, blobs):
+            handle.write(b"\0" * (offset - handle.tell()))
+            handle.write(blob)
+    os.replace(tmp_path, path)
+
+
+class SnapshotTree(RepertoireTree):
+    """
+    Read-only RepertoireTree backed by a memory-mapped snapshot file.
+    Works anywhere a RepertoireTree does: the window shows it with
+    MoveDisplay.show_tree and trains on it, with no database involved.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with open(path, "rb") as handle:
+            size = os.fstat(handle.fileno()).st_size
+            if size < _HEADER.size + _OFFSETS.size:
+                raise SnapshotError(f"Not a ChessForge snapshot: {path}")
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        try:
+            self._load(size)
+        except SnapshotError:
+            self.close()
+            raise
+        except (ValueError, TypeError, IndexError, struct.error) as e:
+            self.close()
+            raise SnapshotError(f"Corrupt snapshot {path}: {e}")
+
+    def _load(self, size):
+        view = self._view
+        magic, version, color, nodes, edges, strings, root = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotError(f"Not a ChessForge snapshot: {self.path}")
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version} (expected {VERSION})")
+        if root != NO_NODE and root >= nodes:
+            raise SnapshotError(f"Corrupt snapshot {self.path}: root node out of range")
+        offsets = dict(zip(_SECTIONS, _OFFSETS.unpack_from(view, _HEADER.size)))
+        lengths = {"hashes": nodes, "first_edge": nodes, "edge_count": nodes, "str_offsets": strings + 1}
+
+        self.color = "White" if color == 0 else "Black"
+        self.root = None if root == NO_NODE else root
+        for key, code in _TYPECODES.items():
+            count = lengths.get(key, edges)
+            end = offsets[key] + count * array(code).itemsize
+            if offsets[key] % 8 or end > size:
+                # A truncated file or a bad offset; the cast below would fail or read garbage
+                raise SnapshotError(f"Corrupt snapshot {self.path}: section '{key}' outside the file")
+            chunk = view[offsets[key]:end]
+            try:
+                if sys.byteorder == "little":
+                    column = chunk.cast(code)
+                else:
+                    # Big-endian hosts pay for one copy
+                    column = array(code, bytes(chunk))
+                    column.byteswap()
+            finally:
+                # Only the cast view may keep the map open
+                chunk.release()
+            setattr(self, key, column)
+
+        str_offsets = self.str_offsets
+        if str_offsets[0] != 0 or any(str_offsets[i] > str_offsets[i + 1] for i in range(strings)):
+            raise SnapshotError(f"Corrupt snapshot {self.path}: string table out of order")
+        if offsets["str_data"] + str_offsets[strings] > size:
+            raise SnapshotError(f"Corrupt snapshot {self.path}: string data outside the file")
+        self.str_data = view[offsets["str_data"]:offsets["str_data"] + str_offsets[strings]]
+        self.name = self.string(1)
+
+    def close(self):
+        # Every view into the map must be released before it can be closed
+        for key in list(_TYPECODES) + ["str_data"]:
+            column = getattr(self, key, None)
+            if isinstance(column, memoryview):
+                column.release()
+        self._view.release()
+        self._mmap.close()
+
+    def string(self, ref):
+        return str(self.str_data[self.str_offsets[ref]:self.str_offsets[ref + 1]], "utf-8")
+
+    def __contains__(self, key):
+        return self.node_for_hash(key) is not None
+
+    def node_for_hash(self, key):
+        index = bisect_left(self.hashes, key)
+        if index < len(self.hashes) and self.hashes[index] == key:
+            return index
+        return None
+
+    def node_for_board(self, board):
+        return self.node_for_hash(position_hash(board))
+
+    def san(self, edge):
+        return self.string(self.san_refs[edge])
+
+    def comment(self, edge):
+        return self.string(self.comment_refs[edge])
+
+
+def export_snapshot(database, repertoire_id, path):
+    rep = [r for r in database.get_repertoires() if r['id'] == repertoire_id][0]
+    tree = RepertoireTree.from_database(database, repertoire_id)
+    write_snapshot(tree, path, rep['name'], rep['color'])
+    return tree
+
+
+def import_snapshot(database, path, name=None):
+    """Creates a new repertoire from a snapshot. Returns the new repertoire id."""
+    tree = SnapshotTree(path)
+    try:
+        # The repertoire and its moves are committed together, or not at all
+        with database.bulk():
+            repertoire_id = database.add_repertoire(name or tree.name or os.path.basename(path), tree.color)
+            if tree.root is None:
+                return repertoire_id
+            visited = {tree.root}
+            stack = [(tree.root, chess.Board())]
+            while stack:
+                node, board = stack.pop()
+                from_fen = board.fen()
+                for edge in tree.edges(node):
+                    child = board.copy(stack=False)
+                    move = tree.edge_move(edge)
+                    child.push(move)
+                    database.add_move(repertoire_id, from_fen, child.fen(), move.uci(), tree.comment(edge))
+                    if tree.target(edge) not in visited:
+                        visited.add(tree.target(edge))
+                        stack.append((tree.target(edge), child))
+        return repertoire_id
+    finally:
+        tree.close()
@@ -0,0 +1,126 @@
+import os
+from collections import OrderedDict
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QByteArray, pyqtSignal, Qt
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtSvg import QSvgRenderer
+import chess
+import chess.svg
+
+
+class _RenderTask(QRunnable):
+    """Renders one board to a QImage on a pool thread (QImage, unlike QPixmap, is thread-safe)."""
+
+    def __init__(self, cache, key, fen, path):
+        super().__init__()
+        self.cache = cache
+        self.key = key
+        self.fen = fen
+        self.path = path
+
+    def run(self):
+        image = QImage(self.path) if self.path and os.path.exists(self.path) else QImage()
+        if not image.isNull():
+            # Mark as recently used, trim_disk() removes the oldest files first
+            os.utime(self.path)
+        else:
+            image = self.render()
+            if self.path:
+                image.save(self.path, "PNG")
+        self.cache.rendered.emit(self.key, image)
+
+    def render(self):
+        _, flipped = self.key
+        size = self.cache.size
+        svg = chess.svg.board(chess.Board(self.fen), size=size, coordinates=False,
+                              orientation=chess.BLACK if flipped else chess.WHITE)
+        renderer = QSvgRenderer(QByteArray(svg.encode("UTF-8")))
+        image = QImage(size, size, QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(image)
+        renderer.render(painter)
+        painter.end()
+        return image
+
+
+class _TrimTask(QRunnable):
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+
+    def run(self):
+        self.cache.trim_disk()
+
+
+class ThumbnailCache(QObject):
+    """
+    Small board previews keyed by (position hash, flipped).
+    Rendering happens on a thread pool, results are kept in a bounded LRU and,
+    if a folder is given, persisted as PNG files for the next session. The
+    folder keeps at most disk_capacity files, least recently used go first.
+    """
+    # Emitted (in the GUI thread) when a requested thumbnail is available
+    thumbnail_ready = pyqtSignal(object)
+    # Internal: worker thread -> GUI thread
+    rendered = pyqtSignal(object, QImage)
+
+    def __init__(self, size=180, capacity=300, cache_dir=None, disk_capacity=5000):
+        super().__init__()
+        self.size = size
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.disk_capacity = disk_capacity
+        self.renders_since_trim = 0
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.images = OrderedDict()
+        self.pending = set()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(2)
+        self.rendered.connect(self.on_rendered)
+        if cache_dir:
+            self.pool.start(_TrimTask(self))
+
+    def trim_disk(self):
+        """Deletes the least recently used PNG files beyond disk_capacity (runs on the pool)."""
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".png")]
+        except OSError:
+            return
+        if len(entries) <= self.disk_capacity:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.disk_capacity]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+        return image
+
+    def request(self, key, fen):
+        """Schedules a render unless the thumbnail is cached or already on its way."""
+        if key in self.images or key in self.pending:
+            return
+        self.pending.add(key)
+        path = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{key[0]:016x}_{int(key[1])}_{self.size}.png")
+        self.pool.start(_RenderTask(self, key, fen, path))
+
+    def on_rendered(self, key, image):
+        self.pending.discard(key)
+        self.images[key] = image
+        self.images.move_to_end(key)
+        while len(self.images) > self.capacity:
+            self.images.popitem(last=False)
+        if self.cache_dir:
+            self.renders_since_trim += 1
+            if self.renders_since_trim >= self.disk_capacity // 10:
+                self.renders_since_trim = 0
+                self.pool.start(_TrimTask(self))
+        self.thumbnail_ready.emit(key)
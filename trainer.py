@@ -8,10 +8,13 @@ class RepertoireTrainer:
         self.repertoire_id = None
         self.color = None  # chess.WHITE or chess.BLACK
         self.current_fen = None
+        # Optional RepertoireTree: when set, lookups are served from memory
+        self.tree = None
 
-    def start_session(self, repertoire_id, color_name):
+    def start_session(self, repertoire_id, color_name, tree=None):
         """Starts a new training session."""
         self.repertoire_id = repertoire_id
+        self.tree = tree
         self.color = chess.WHITE if color_name == "White" else chess.BLACK
         self.current_fen = chess.STARTING_FEN
 
@@ -25,6 +28,13 @@ class RepertoireTrainer:
         Verifies if the user's move exists in the repertoire.
         Returns: (is_correct, comment)
         """
+        if self.tree is not None:
+            node = self.tree.node_for_board(board)
+            edge = self.tree.find_edge(node, chess.Move.from_uci(move_uci)) if node is not None else None
+            if edge is None:
+                return False, "Move not in repertoire."
+            return True, self.tree.comment(edge)
+
         # Look for this specific move in the DB
         moves = self.db.get_moves_from_fen(self.repertoire_id, board.fen())
 
@@ -39,6 +49,13 @@ class RepertoireTrainer:
         Picks a move for the opponent from the database.
         Returns: chess.Move or None (if end of line)
         """
+        if self.tree is not None:
+            node = self.tree.node_for_board(chess.Board(fen))
+            edges = self.tree.edges(node) if node is not None else ()
+            if not edges:
+                return None
+            return self.tree.edge_move(random.choice(edges))
+
         moves = self.db.get_moves_from_fen(self.repertoire_id, fen)
 
         if not moves:
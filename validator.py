@@ -0,0 +1,152 @@
+"""
+Repertoire validation and repair.
+
+Loads a whole repertoire with one query and replays every stored move from its
+start position, reporting:
+    - moves whose UCI cannot be parsed or is illegal in its start position
+    - moves whose to_position_id does not match the position the move leads to
+      (or points at a missing position)
+    - moves whose from_position_id points at a missing position
+    - duplicate moves (same start position and UCI)
+    - moves that cannot be reached from the initial position
+Large repertoires are replayed in worker processes. Repairs happen in one
+transaction.
+"""
+import os
+import multiprocessing
+
+import chess
+
+from database import ChessDatabase, START_FEN
+
+# Below this many moves, starting worker processes costs more than it saves:
+# at 17k-22k moves the pool was no faster than replaying serially (1.5-2 s either way)
+PARALLEL_THRESHOLD = 100000
+
+
+def _clean(fen):
+    return " ".join(fen.split(" ")[:4])
+
+
+def _replay_group(group):
+    """
+    Replays all moves of one start position.
+    group: (from_fen, [(move_id, uci, to_fen), ...])
+    Returns [(move_id, problem, correct_to_fen)], problem is None for good moves.
+    """
+    from_fen, moves = group
+    board = chess.Board(from_fen)
+    results = []
+    for move_id, uci, to_fen in moves:
+        try:
+            move = chess.Move.from_uci(uci)
+        except ValueError:
+            results.append((move_id, "bad_uci", None))
+            continue
+        if not board.is_legal(move):
+            results.append((move_id, "illegal", None))
+            continue
+        board.push(move)
+        reached = _clean(board.fen())
+        board.pop()
+        results.append((move_id, None if reached == to_fen else "wrong_target", reached))
+    return results
+
+
+class ValidationReport:
+    def __init__(self, repertoire_id):
+        self.repertoire_id = repertoire_id
+        self.moves = 0
+        self.invalid = []        # [(move_id, "bad_uci" | "illegal" | "missing_from")]
+        self.wrong_target = []   # [(move_id, correct_fen)], includes a missing to position
+        self.dangling = []       # [move_id] pointing at a missing position (also listed above)
+        self.duplicates = []     # [(move_id, kept_move_id)]
+        self.unreachable = []    # [move_id]
+
+    @property
+    def issue_count(self):
+        return len(self.invalid) + len(self.wrong_target) + len(self.duplicates) + len(self.unreachable)
+
+    def summary(self):
+        return (f"{len(self.invalid)} invalid, {len(self.wrong_target)} wrong target, "
+                f"{len(self.duplicates)} duplicate, {len(self.unreachable)} unreachable, "
+                f"{len(self.dangling)} dangling")
+
+
+def validate_repertoire(database, repertoire_id, workers=None):
+    report = ValidationReport(repertoire_id)
+    rows = database.get_repertoire_moves(repertoire_id)
+    report.moves = len(rows)
+
+    groups = {}
+    for row in rows:
+        if row['from_fen'] is None or row['to_fen'] is None:
+            report.dangling.append(row['id'])
+        if row['from_fen'] is None:
+            # Without its start position the move cannot be replayed; its subtree shows up as unreachable
+            report.invalid.append((row['id'], "missing_from"))
+            continue
+        groups.setdefault(row['from_fen'], []).append((row['id'], row['uci'], row['to_fen']))
+    tasks = list(groups.items())
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(rows) >= PARALLEL_THRESHOLD:
+        # Spawn, not fork: the GUI calls this from a thread, and forking a threaded process can deadlock
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            replayed = pool.map(_replay_group, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+    else:
+        replayed = map(_replay_group, tasks)
+
+    reached = {}
+    for results in replayed:
+        for move_id, problem, correct_fen in results:
+            if problem in ("bad_uci", "illegal"):
+                report.invalid.append((move_id, problem))
+                continue
+            if problem == "wrong_target":
+                report.wrong_target.append((move_id, correct_fen))
+            reached[move_id] = correct_fen
+
+    # Duplicates and reachability only consider moves that replayed correctly
+    kept = {}
+    children = {}
+    for row in rows:
+        if row['id'] not in reached:
+            continue
+        key = (row['from_fen'], row['uci'])
+        if key in kept:
+            report.duplicates.append((row['id'], kept[key]))
+            continue
+        kept[key] = row['id']
+        children.setdefault(row['from_fen'], []).append(row['id'])
+
+    from_fens = {row['id']: row['from_fen'] for row in rows}
+    visited = {START_FEN}
+    stack = [START_FEN]
+    while stack:
+        for move_id in children.get(stack.pop(), ()):
+            target = reached[move_id]
+            if target not in visited:
+                visited.add(target)
+                stack.append(target)
+    for move_ids in children.values():
+        for move_id in move_ids:
+            if from_fens[move_id] not in visited:
+                report.unreachable.append(move_id)
+    return report
+
+
+def validate_all(db_path, workers=None):
+    """Validates every repertoire on a connection of its own, so it can run on a background thread."""
+    folder, filename = os.path.split(db_path)
+    database = ChessDatabase(filename, data_folder=folder, verbose=False)
+    try:
+        return [validate_repertoire(database, r['id'], workers) for r in database.get_repertoires()]
+    finally:
+        database.close()
+
+
+def repair_repertoire(database, report):
+    """Applies a report: drops invalid, duplicate and unreachable moves, fixes wrong targets."""
+    delete_ids = [move_id for move_id, _ in report.invalid] + report.unreachable
+    database.repair_moves(delete_ids=delete_ids, retarget=report.wrong_target, duplicates=report.duplicates)